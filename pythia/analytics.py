@@ -173,8 +173,22 @@ def collate_outputs(config, run):
     mgmt_info = run.get("management", None)
     late_season_flag = run.get("lateSeason", False)
     collected_first_line = False
-    for current_dir in _generated_run_files(work_dir, "summary.csv"):
-        lat, lng = extract_ll(current_dir)
+    run_dirs = list(_generated_run_files(work_dir, "summary.csv"))
+    # Sites simulated by each directory, when setup snapped or collapsed them or
+    # laid them out in sharded directories.
+    members = pythia.io.read_pixel_members(work_dir)
+    if config.get("pixelOrder"):
+        locations = pythia.io.read_pixel_locations([work_dir])
+        run_dirs = [
+            run_dirs[idx]
+            for idx in pythia.util.path_curve_order(
+                run_dirs, config["pixelOrder"], locations
+            )
+        ]
+    for current_dir in run_dirs:
+        locations = members.get(os.path.abspath(current_dir)) or [
+            extract_ll(current_dir)
+        ]
         if collected_first_line:
             mode = "a"
         else:
@@ -208,39 +222,40 @@ def collate_outputs(config, run):
                         dest.write("{},{}\n".format(additional_headers, line.strip()))
                         collected_first_line = True
                 else:
-                    to_write = (lat, lng, run.get("name", ""))
-                    if season_info is not None:
-                        to_write = to_write + (season_info,)
-                        if late_season_flag:
-                            to_write = to_write + (str(True),)
-                        else:
-                            to_write = to_write + (str(False),)
-                    if mgmt_info is not None:
-                        to_write = to_write + (mgmt_info,)
-                    if ds_harea is not None and not ds_harea.closed:
-                        harea = pythia.io.get_site_raster_value(
-                            ds_harea, band_harea, (float(lng), float(lat))
-                        )
-                        if harea is None:
-                            harea = 0
-                            logging.warning(
-                                "%s, %s is giving an invalid harea, replacing with 0"
+                    for lat, lng in locations:
+                        to_write = (lat, lng, run.get("name", ""))
+                        if season_info is not None:
+                            to_write = to_write + (season_info,)
+                            if late_season_flag:
+                                to_write = to_write + (str(True),)
+                            else:
+                                to_write = to_write + (str(False),)
+                        if mgmt_info is not None:
+                            to_write = to_write + (mgmt_info,)
+                        if ds_harea is not None and not ds_harea.closed:
+                            harea = pythia.io.get_site_raster_value(
+                                ds_harea, band_harea, (float(lng), float(lat))
                             )
-                        harea_s = "{:0.2f}".format(harea)
-                        to_write = to_write + (harea_s,)
-                    if ds_pop is not None and not ds_pop.closed:
-                        pop = pythia.io.get_site_raster_value(
-                            ds_pop, band_pop, (float(lng), float(lat))
-                        )
-                        if pop is None:
-                            pop = 0
-                            logging.warning(
-                                "%s, %s is giving an invalid population, replacing with 0"
+                            if harea is None:
+                                harea = 0
+                                logging.warning(
+                                    "%s, %s is giving an invalid harea, replacing with 0"
+                                )
+                            harea_s = "{:0.2f}".format(harea)
+                            to_write = to_write + (harea_s,)
+                        if ds_pop is not None and not ds_pop.closed:
+                            pop = pythia.io.get_site_raster_value(
+                                ds_pop, band_pop, (float(lng), float(lat))
                             )
-                        pop_s = "{:0.2f}".format(pop)
-                        to_write = to_write + (pop_s,)
-                    to_write = to_write + (line.strip() + "\n",)
-                    dest.write(",".join(to_write))
+                            if pop is None:
+                                pop = 0
+                                logging.warning(
+                                    "%s, %s is giving an invalid population, replacing with 0"
+                                )
+                            pop_s = "{:0.2f}".format(pop)
+                            to_write = to_write + (pop_s,)
+                        to_write = to_write + (line.strip() + "\n",)
+                        dest.write(",".join(to_write))
             if ds_harea is not None:
                 ds_harea.close()
             if ds_pop is not None:
@@ -1 +1,192 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+import pythia.io
+import pythia.raster_cube
+import pythia.util
+
 cache = {}
+
+PEER_CACHE_VERSION = 1
+PIXEL_FINGERPRINT_VERSION = 1
+PIXEL_FINGERPRINT_FILE = ".pythia_setup"
+
+
+def cache_dir(config):
+    """The directory holding Pythia's on-disk caches for this configuration."""
+    return config.get(
+        "cacheDir", os.path.join(config.get("workDir", "."), ".pythia_cache")
+    )
+
+
+def file_signature(path):
+    """The absolute path, modification time and size of a file, used in cache keys."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [os.path.abspath(path), None, None]
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def fingerprint(payload):
+    """A stable hex digest of a JSON-serializable payload."""
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def peer_fingerprint(run, sample_size=None, snap=None, cube=None):
+    """
+    Fingerprint the inputs of `pythia.io.peer` for a run: the site source, the
+    raster layers with the size and modification time of each file, the sample
+    size, the grid the sites snap to and the raster cube the layers are read
+    from, whose resampled values can differ from the source rasters.
+    """
+    sites = run["sites"]
+    if isinstance(sites, list):
+        site_source = sites
+    else:
+        site_source = [sites, file_signature(sites.split("::")[1])]
+    rasters = pythia.util.get_rasters_dict(run)
+    payload = {
+        "version": PEER_CACHE_VERSION,
+        "sites": site_source,
+        "rasters": [[k, file_signature(v)] for k, v in rasters.items()],
+        "sample": sample_size,
+    }
+    grid = pythia.io.snap_grid(run, snap)
+    if grid is not None:
+        payload["snap"] = file_signature(grid)
+    if cube:
+        payload["cube"] = file_signature(cube)
+    return fingerprint(payload)
+
+
+def peer_cache_file(config, run):
+    return os.path.join(
+        cache_dir(config),
+        "peer-{}.npz".format(
+            peer_fingerprint(
+                run,
+                config.get("sample", None),
+                config.get("snapToGrid"),
+                config.get("rasterCube"),
+            )
+        ),
+    )
+
+
+def save_peer(path, table):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {
+        "lng": table.lng,
+        "lat": table.lat,
+        "layers": np.array(list(table.layers.keys()), dtype=str),
+    }
+    for idx, values in enumerate(table.layers.values()):
+        arrays["layer_{}".format(idx)] = values
+    if table.members is not None:
+        arrays["member_lng"], arrays["member_lat"], arrays["member_owner"] = table.members
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_peer(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            layers = {
+                str(layer): data["layer_{}".format(idx)]
+                for idx, layer in enumerate(data["layers"])
+            }
+            members = None
+            if "member_owner" in data:
+                members = (data["member_lng"], data["member_lat"], data["member_owner"])
+            return pythia.io.PixelTable(data["lng"], data["lat"], layers, members)
+    except (OSError, KeyError, ValueError) as exc:
+        logging.warning("Ignoring unreadable peer cache %s: %s", path, exc)
+        return None
+
+
+def pixel_fingerprint(context, config):
+    """
+    Fingerprint everything that goes into a pixel directory: the resolved
+    context, the template file and the weather directory the links point to.
+    """
+    payload = {
+        "version": PIXEL_FINGERPRINT_VERSION,
+        "context": dict(context),
+        "template": file_signature(
+            os.path.join(config["templateDir"], context["template"])
+        ),
+        "weatherDir": config.get("weatherDir"),
+    }
+    return fingerprint(payload)
+
+
+def _pixel_record_file(output_dir):
+    return os.path.join(output_dir, PIXEL_FINGERPRINT_FILE)
+
+
+def pixel_unchanged(output_dir, xfile, signature):
+    """
+    Whether `output_dir` was written by a previous setup with the same
+    fingerprint and its X-file has not been modified since.
+    """
+    try:
+        with open(_pixel_record_file(output_dir)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return record == {
+        "fingerprint": signature,
+        "xfile": file_signature(os.path.join(output_dir, xfile)),
+    }
+
+
+def save_pixel_fingerprint(output_dir, xfile, signature):
+    record = {
+        "fingerprint": signature,
+        "xfile": file_signature(os.path.join(output_dir, xfile)),
+    }
+    with open(_pixel_record_file(output_dir), "w") as f:
+        json.dump(record, f)
+
+
+def _sample_runs(runs, config):
+    sample_size = config.get("sample", None)
+    sampling = config.get("rasterSampling", "windowed")
+    snap = config.get("snapToGrid")
+    if not config.get("rasterCube"):
+        return pythia.io.peer_runs(runs, sample_size, sampling, snap=snap)
+    with pythia.raster_cube.RasterCube(config["rasterCube"]) as cube:
+        return pythia.io.peer_runs(runs, sample_size, sampling, cube, snap)
+
+
+def peer_runs(runs, config):
+    """
+    Peer every run, loading the pixel table from the peer cache when the sites,
+    rasters and sample size are unchanged since it was written.
+
+    :returns: A list of PixelTables aligned with `runs`.
+    """
+    if not config.get("peerCache", True):
+        return _sample_runs(runs, config)
+
+    cache_files = [peer_cache_file(config, run) for run in runs]
+    peers = [load_peer(f) for f in cache_files]
+    misses = [idx for idx, table in enumerate(peers) if table is None]
+    logging.info("[PEER CACHE] %d hits, %d misses", len(runs) - len(misses), len(misses))
+    if not misses:
+        return peers
+    sampled = _sample_runs([runs[idx] for idx in misses], config)
+    for idx, table in zip(misses, sampled):
+        save_peer(cache_files[idx], table)
+        peers[idx] = table
+    return peers
@@ -12,6 +12,7 @@ import pythia.example_data
 import pythia.io
 import pythia.peerless
 import pythia.plugin
+import pythia.raster_cube
 from pythia.custom_raster_creator import main as raster_main
 
 
@@ -80,7 +81,17 @@ def main():
         default="pythia",
         help="Prefix the log file with this string. <prefix|pythia>-YYYYmmdd-hhMMSS.log",
     )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rewrite the run structure from the contexts stored by the previous setup",
+    )
     parser.add_argument("--quiet", action="store_true", help="Enjoy the silence")
+    parser.add_argument(
+        "--build-raster-cube",
+        metavar="CUBE",
+        help="Stack every raster layer of the configuration into one aligned GeoTIFF and use it for setup",
+    )
 
     example_group = parser.add_mutually_exclusive_group()
     example_group.add_argument(
@@ -235,6 +246,11 @@ def main():
 
             shutil.rmtree(config["workDir"])
 
+    if args.build_raster_cube:
+        print("Building the aligned raster cube")
+        pythia.raster_cube.build_cube(config, args.build_raster_cube)
+        config["rasterCube"] = args.build_raster_cube
+
     config["exportRunlist"] = args.export_runlist
     plugins = pythia.plugin.load_plugins(config, {})
     config = pythia.plugin.run_plugin_functions(
@@ -246,6 +262,9 @@ def main():
     if args.all or args.setup:
         print("Setting up points and directory structure")
         pythia.peerless.execute(config, plugins)
+    elif args.render_only:
+        print("Rendering the directory structure from the stored contexts")
+        pythia.peerless.render(config, plugins)
 
     if args.all or args.run_dssat:
         print("Running DSSAT over the directory structure")
@@ -5,6 +5,7 @@ import os
 
 import pythia.functions
 import pythia.io
+import pythia.util
 
 
 def load_config(config_file, validate=True, merge=True):
@@ -53,7 +54,7 @@ def _validate_config(config):
         set(
             [
                 pythia.functions.extract_raster(raster)
-                for raster in list(filter(lambda x: "raster::" in str(x), values_iter))
+                for raster in list(filter(pythia.util.is_raster_lookup, values_iter))
             ]
         )
     )
@@ -0,0 +1,82 @@
+"""
+Layered pixel contexts.
+
+Every pixel of a run starts from the same run configuration. A `PixelContext`
+shares that dictionary as its read-only base and keeps only the values set for
+the pixel (coordinates, sampled layers, lookup results and plugin changes) in
+a small overrides dictionary, so building a context does not copy the run.
+
+Runs registered with `register_runs` are pickled by index, so a context sent
+between setup processes carries only its overrides.
+"""
+from collections.abc import MutableMapping
+
+_runs = {}
+
+
+def register_runs(runs):
+    """Register the runs of this process so their contexts pickle by index."""
+    _runs.clear()
+    _runs.update(enumerate(runs))
+
+
+def _restore(run_idx, overrides, deleted):
+    return PixelContext(_runs[run_idx], overrides, run_idx, deleted)
+
+
+class PixelContext(MutableMapping):
+    """A mapping of per-pixel overrides on top of a shared run dictionary."""
+
+    __slots__ = ("base", "overrides", "run_idx", "deleted")
+
+    def __init__(self, base, overrides=None, run_idx=None, deleted=None):
+        self.base = base
+        self.overrides = {} if overrides is None else overrides
+        self.run_idx = run_idx
+        self.deleted = set() if deleted is None else deleted
+
+    def __getitem__(self, key):
+        try:
+            return self.overrides[key]
+        except KeyError:
+            if key in self.deleted:
+                raise
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.overrides.pop(key, None)
+        if key in self.base:
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self.overrides:
+            return True
+        return key not in self.deleted and key in self.base
+
+    def __iter__(self):
+        yield from self.overrides
+        for key in self.base:
+            if key not in self.overrides and key not in self.deleted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "PixelContext({!r})".format(dict(self))
+
+    def copy(self):
+        return PixelContext(
+            self.base, dict(self.overrides), self.run_idx, set(self.deleted)
+        )
+
+    def __reduce__(self):
+        if self.run_idx is None or _runs.get(self.run_idx) is not self.base:
+            return (dict, (dict(self),))
+        return (_restore, (self.run_idx, self.overrides, self.deleted))
@@ -0,0 +1,108 @@
+"""
+Resolved pixel contexts persisted by setup.
+
+With ``contextStore`` enabled, every setup worker appends the contexts returned
+by `pythia.peerless.build_context` to its own pickle shard under
+``<cacheDir>/contexts/<run>/``, one per tile in a tiled setup. ``pythia --render-only`` reads them back to
+apply the templates and ``post_build_context`` plugins again without running
+any of the lookups in `pythia.functions`.
+"""
+import logging
+import os
+import pickle
+import shutil
+import threading
+
+import pythia.cache_manager
+
+_shards = {}
+_lock = threading.Lock()
+
+
+def run_store_dir(config, run):
+    """The store directory of a run, keyed by the run work directory."""
+    key = pythia.cache_manager.fingerprint(os.path.abspath(run["workDir"]))
+    return os.path.join(pythia.cache_manager.cache_dir(config), "contexts", key)
+
+
+def close():
+    """Close the shards opened by this process."""
+    with _lock:
+        for shard in _shards.values():
+            shard.close()
+        _shards.clear()
+
+
+def reset(config, runs):
+    """Remove the stored contexts of `runs` before a new setup writes them."""
+    close()
+    for run in runs:
+        store_dir = run_store_dir(config, run)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.makedirs(store_dir)
+
+
+def _shard_prefix(tile):
+    return "" if tile is None else "tile_{}.".format(tile)
+
+
+def _shard(config, context, tile=None):
+    path = os.path.join(
+        run_store_dir(config, context),
+        "{}{}.pkl".format(_shard_prefix(tile), os.getpid()),
+    )
+    if path not in _shards:
+        _shards[path] = open(path, "ab")
+    return _shards[path]
+
+
+def save(config, context, tile=None):
+    """Append a resolved context to this process' shard of its run and tile."""
+    with _lock:
+        shard = _shard(config, context, tile)
+        pickle.dump(dict(context), shard, protocol=pickle.HIGHEST_PROTOCOL)
+        shard.flush()
+
+
+def discard(config, runs, tile):
+    """
+    Remove the contexts stored for `tile` of `runs`, left behind by a setup
+    interrupted while it was setting up the tile.
+    """
+    prefix = _shard_prefix(tile)
+    with _lock:
+        for run in runs:
+            store_dir = run_store_dir(config, run)
+            if not os.path.isdir(store_dir):
+                continue
+            for shard_name in os.listdir(store_dir):
+                if not shard_name.startswith(prefix):
+                    continue
+                path = os.path.join(store_dir, shard_name)
+                if path in _shards:
+                    _shards.pop(path).close()
+                os.remove(path)
+
+
+def exists(config, run):
+    return os.path.isdir(run_store_dir(config, run))
+
+
+def load(config, run):
+    """Yield the stored contexts of `run`."""
+    store_dir = run_store_dir(config, run)
+    for shard_name in sorted(os.listdir(store_dir)):
+        if not shard_name.endswith(".pkl"):
+            continue
+        with open(os.path.join(store_dir, shard_name), "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+                except pickle.UnpicklingError as exc:
+                    logging.warning(
+                        "[CONTEXT STORE] Truncated shard %s: %s", shard_name, exc
+                    )
+                    break
@@ -2,11 +2,11 @@ import logging
 import multiprocessing as mp
 import os
 import subprocess
-from multiprocessing.pool import Pool
 
+import pythia.executors
+import pythia.io
 import pythia.plugin
-
-async_error = False
+import pythia.util
 
 
 def _run_dssat(details, config, plugins):
@@ -72,6 +72,13 @@ def _generate_run_list(config):
     return runlist
 
 
+def _order_run_list(run_list, curve, locations=None):
+    order = pythia.util.path_curve_order(
+        [details["dir"] for details in run_list], curve, locations
+    )
+    return [run_list[idx] for idx in order]
+
+
 def display_async(details):
     loc, xfile, out, error, retcode = details
     error_count = len(out.decode().split("\n")) - 1
@@ -83,9 +90,9 @@ def display_async(details):
             out.decode()[:-1],
         )
         print("X", end="", flush=True)
-        async_error = True
-    else:
-        print(".", end="", flush=True)
+        return True
+    print(".", end="", flush=True)
+    return False
 
 
 def silent_async(details):
@@ -98,20 +105,28 @@ def silent_async(details):
             error_count,
             out.decode()[:-1],
         )
-        async_error = True
+        return True
+    return False
 
 
 def execute(config, plugins):
     pool_size = config.get("cores", mp.cpu_count())
     run_list = _generate_run_list(config)
-    with Pool(processes=pool_size) as pool:
-        for details in run_list:  # _generate_run_list(config):
-            if config["silence"]:
-                pool.apply_async(_run_dssat, (details, config, plugins), callback=silent_async)
-            else:
-                pool.apply_async(_run_dssat, (details, config, plugins), callback=display_async)
-        pool.close()
-        pool.join()
+    if config.get("pixelOrder"):
+        locations = pythia.io.read_pixel_locations(
+            [run["workDir"] for run in config.get("runs", [])]
+        )
+        run_list = _order_run_list(run_list, config["pixelOrder"], locations)
+    report = silent_async if config["silence"] else display_async
+    async_error = False
+    tasks = ((details, config, plugins) for details in run_list)
+    window = config.get("maxTasksInFlight", pool_size * 8)
+    with pythia.executors.create(config, "dssat", pool_size) as executor:
+        for result in pythia.executors.bounded_results(
+            executor, _run_dssat, tasks, window
+        ):
+            if report(result):
+                async_error = True
 
     if async_error:
         print(
@@ -0,0 +1,134 @@
+"""
+Executor backends for the setup and DSSAT stages.
+
+The backend of a stage is chosen in the ``executors`` section of the
+configuration, for example::
+
+    "executors": {
+        "setup": "process",
+        "dssat": {"backend": "chunked", "chunkSize": 16, "startMethod": "forkserver"}
+    }
+
+All backends implement `concurrent.futures.Executor` and run their
+initializer before the first task, so the stages submit and collect their
+tasks the same way through `bounded_results` whatever the backend.
+"""
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing as mp
+
+BACKENDS = ("serial", "thread", "process", "chunked")
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """Run every task in the calling process when it is submitted."""
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+class ThreadExecutor(concurrent.futures.ThreadPoolExecutor):
+    """A thread pool sharing one initialized process state."""
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+        super().__init__(max_workers=max_workers)
+
+
+class ChunkedProcessPoolExecutor(concurrent.futures.ProcessPoolExecutor):
+    """A process pool that `bounded_results` feeds `chunksize` tasks at a time."""
+
+    def __init__(self, chunksize=8, **kwargs):
+        super().__init__(**kwargs)
+        self.chunksize = chunksize
+
+
+def stage_options(config, stage):
+    """The executor options of a stage, with the backend name under ``backend``."""
+    options = config.get("executors", {}).get(stage, "process")
+    if isinstance(options, str):
+        options = {"backend": options}
+    backend = options.get("backend", "process")
+    if backend not in BACKENDS:
+        raise ValueError(
+            "Unknown {} executor {}, expected one of {}".format(
+                stage, backend, ", ".join(BACKENDS)
+            )
+        )
+    return {**options, "backend": backend}
+
+
+def create(config, stage, max_workers, initializer=None, initargs=()):
+    """Create the executor configured for `stage` ("setup" or "dssat")."""
+    options = stage_options(config, stage)
+    backend = options["backend"]
+    logging.info("[EXECUTOR] %s: %s with %d workers", stage, backend, max_workers)
+    if backend == "serial":
+        return SerialExecutor(max_workers, initializer, initargs)
+    if backend == "thread":
+        return ThreadExecutor(max_workers, initializer, initargs)
+    kwargs = {
+        "max_workers": max_workers,
+        "initializer": initializer,
+        "initargs": initargs,
+    }
+    if options.get("startMethod"):
+        kwargs["mp_context"] = mp.get_context(options["startMethod"])
+    if backend == "chunked":
+        return ChunkedProcessPoolExecutor(options.get("chunkSize", 8), **kwargs)
+    return concurrent.futures.ProcessPoolExecutor(**kwargs)
+
+
+def _run_chunk(fn, chunk):
+    return [fn(*task) for task in chunk]
+
+
+def _chunks(tasks, size):
+    tasks = iter(tasks)
+    while True:
+        chunk = list(itertools.islice(tasks, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _submit_bounded(executor, fn, tasks, window):
+    pending = set()
+    for task in tasks:
+        pending.add(executor.submit(fn, *task))
+        if len(pending) >= window:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                yield future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
+
+
+def bounded_results(executor, fn, tasks, window):
+    """
+    Submit `fn(*task)` for every task while keeping at most `window` tasks in
+    flight, yielding results as they complete and refilling the window.
+    Chunked executors receive the tasks in lists of their ``chunksize``.
+    Exceptions raised by a task are raised again here.
+    """
+    chunksize = getattr(executor, "chunksize", 1)
+    if chunksize <= 1:
+        yield from _submit_bounded(executor, fn, tasks, window)
+        return
+    chunk_tasks = ((fn, chunk) for chunk in _chunks(tasks, chunksize))
+    chunk_window = max(1, window // chunksize)
+    for results in _submit_bounded(executor, _run_chunk, chunk_tasks, chunk_window):
+        yield from results
@@ -14,6 +14,7 @@ from rasterio.warp import transform as transform_coordinates
 from rasterio.windows import Window
 
 import pythia.io
+import pythia.shared_rasters
 import pythia.soil_handler
 import pythia.template
 import pythia.util
@@ -33,6 +34,60 @@ def extract_raster(s):
     return args[raster_idx + 1]
 
 
+@lru_cache(maxsize=None)
+def lookup_args(spec):
+    """
+    The arguments of a lookup string, i.e. everything after the function name,
+    parsed once per distinct string.
+
+    :param spec: Lookup string such as ``lookup_ghr::raster::soil.tif``.
+    :returns: A tuple of the ``::`` separated arguments.
+    """
+    return tuple(spec.split("::")[1:])
+
+
+# Lookups whose result only depends on a few inputs, mapped to a function
+# returning those inputs for a pixel. See `pythia.plan.LookupCache`.
+PURE_FUNCTIONS = {}
+
+
+def pure(inputs):
+    """
+    Declare a lookup as pure: its result for key `k` only depends on
+    ``inputs(k, run, context)``, so it can be memoized across pixels.
+    """
+
+    def register(fn):
+        PURE_FUNCTIONS[fn.__name__] = inputs
+        return fn
+
+    return register
+
+
+def _reference(arg, context):
+    return context.get(arg[1:]) if arg.startswith("$") else None
+
+
+def _raster_value_inputs(k, run, context):
+    return (context.get(k), run.get("startYear"), lookup_args(run[k]))
+
+
+def _reference_inputs(k, run, context):
+    args = lookup_args(run[k])
+    return (_reference(args[0], context), args)
+
+
+def _ic_layers_inputs(k, run, context):
+    args = lookup_args(run[k])
+    profile = args[0][1:] if args[0].startswith("$") else args[0]
+    return (
+        context.get(profile),
+        tuple(context.get("soilFiles", ())),
+        run.get("icin"),
+        run.get("icsw%"),
+    )
+
+
 def xy_from_vector(v):
     """
     Extracts XY coordinates from a vector-based lookup string. This function parses
@@ -46,6 +101,33 @@ def xy_from_vector(v):
     return pythia.io.extract_vector_coords(args[1])
 
 
+def xy_from_raster(v):
+    """
+    Derives site coordinates from a mask raster. Every unmasked cell whose value is
+    nonzero, or greater than the optional threshold, becomes a site at the cell center.
+
+    :param v: Lookup string in the format 'xy_from_raster::<path_to_raster>[::threshold]'.
+    :returns: An (N, 2) array of XY coordinate pairs in row-major cell order.
+    :raises ValueError: If the threshold is not a number.
+    """
+    args = v.split("::")
+    threshold = float(args[2]) if len(args) > 2 else None
+    return pythia.io.extract_raster_coords(args[1], threshold)
+
+
+def xy_from_table(v):
+    """
+    Bulk-loads XY coordinates from a CSV, `.npy` or `.npz` site table with longitude
+    and latitude columns (`lng`/`lon`/`x` and `lat`/`y`).
+
+    :param v: Lookup string in the format 'xy_from_table::<path_to_table>'.
+    :returns: An (N, 2) array of XY coordinate pairs in table order.
+    :raises ValueError: If the table has no longitude or latitude column.
+    """
+    args = v.split("::")
+    return pythia.io.extract_table_coords(args[1])
+
+
 def xy_from_list(lst):
     """
     Converts a list of coordinate-like sequences into (x, y) tuples. Coordinates are
@@ -57,6 +139,7 @@ def xy_from_list(lst):
     return [tuple(x[::-1]) for x in lst]
 
 
+@pure(_raster_value_inputs)
 def auto_planting_window(k, run, context, _):
     """
     Computes an automatic planting window based on planting-date parameters encoded in
@@ -71,7 +154,7 @@ def auto_planting_window(k, run, context, _):
     :raises ValueError: If the lookup string is malformed or missing expected components.
     """
     """multiple rasters not yet supported"""
-    args = run[k].split("::")[1:]
+    args = list(lookup_args(run[k]))
     raster_idx = args.index("raster")
     args[raster_idx + 1] = context[k]
     args.pop(raster_idx)
@@ -86,9 +169,10 @@ def auto_planting_window(k, run, context, _):
     }
 
 
+@pure(_raster_value_inputs)
 def auto_planting_window_doy(k, run, context, _):
     """multiple rasters not yet supported"""
-    args = run[k].split("::")[1:]
+    args = list(lookup_args(run[k]))
     raster_idx = args.index("raster")
     args[raster_idx + 1] = context[k]
     args.pop(raster_idx)
@@ -105,11 +189,15 @@ def auto_planting_window_doy(k, run, context, _):
 
 def auto_planting_window_doy_shape(k, run, context, _):
     """multiple rasters not yet supported"""
-    args = run[k].split("::")[1:]
-    finder = pythia.io.find_closest_vector_coords
+    args = lookup_args(run[k])
     cell_doy = None
     if "vector" in args:
         idx = args.index("vector")
+        finder = pythia.io.find_closest_vector_coords
+        cell_doy = finder(args[idx + 1], context["lng"], context["lat"], args[idx + 2])
+    elif "table" in args:
+        idx = args.index("table")
+        finder = pythia.io.find_closest_table_coords
         cell_doy = finder(args[idx + 1], context["lng"], context["lat"], args[idx + 2])
 
     first = datetime.datetime(run["startYear"], 1, 1) + datetime.timedelta(int(cell_doy) + int(args[idx + 3]))
@@ -122,8 +210,9 @@ def auto_planting_window_doy_shape(k, run, context, _):
     }
 
 
+@pure(_raster_value_inputs)
 def lookup_hc27(k, run, context, _):
-    args = run[k].split("::")[1:]
+    args = lookup_args(run[k])
     if "raster" in args:
         return {k: "HC_GEN{:0>4}".format(context[k])}
     else:
@@ -131,17 +220,22 @@ def lookup_hc27(k, run, context, _):
 
 
 def lookup_wth(k, run, context, _):
-    args = run[k].split("::")[1:]
-    finder = pythia.io.find_closest_vector_coords
+    args = lookup_args(run[k])
     cell_id = None
     if "vector" in args:
         idx = args.index("vector")
+        finder = pythia.io.find_closest_vector_coords
+        cell_id = finder(args[idx + 1], context["lng"], context["lat"], args[idx + 2])
+    elif "table" in args:
+        idx = args.index("table")
+        finder = pythia.io.find_closest_table_coords
         cell_id = finder(args[idx + 1], context["lng"], context["lat"], args[idx + 2])
     return {k: args[0], "wthFile": "{}.WTH".format(cell_id)}
 
 
+@pure(_ic_layers_inputs)
 def generate_ic_layers(k, run, context, _):
-    args = run[k].split("::")[1:]
+    args = lookup_args(run[k])
     if args[0].startswith("$"):
         profile = args[0][1:]
     else:
@@ -400,6 +494,9 @@ def _lookup_ghr_profile_cached(
 
 
 def _lookup_ghr_profile(config, soil_id: int) -> Optional[str]:
+    shared = pythia.shared_rasters.ghr_profiles(config)
+    if shared is not None:
+        return shared.lookup(soil_id)
     resolved = _ghr_database_path(config)
     return _lookup_ghr_profile_cached(
         str(resolved), resolved.stat().st_mtime_ns, soil_id
@@ -486,7 +583,7 @@ def _soil_file_for_profile(profile_code: str, config) -> Optional[Path]:
 
 
 def lookup_ghr(k, run, context, config):
-    args = run[k].split("::")[1:]
+    args = lookup_args(run[k])
     if "raster" not in args:
         logging.error("lookup_ghr: Expected raster mode.")
         return None
@@ -509,7 +606,7 @@ def lookup_ghr(k, run, context, config):
         return None
 
     try:
-        with rasterio.open(str(raster_path)) as src:
+        with pythia.shared_rasters.open_raster(str(raster_path), config) as src:
             if src.count == 1:
                 logging.debug("Using legacy one-band GHR soil lookup for %s.", raster_path)
                 if _point_to_raster_pixel(src, lat, lon) is None:
@@ -548,8 +645,9 @@ def lookup_ghr(k, run, context, config):
     }
 
 
+@pure(_reference_inputs)
 def split_fert_dap_percent(k, run, context, _):
-    args = run[k].split("::")[1:]
+    args = lookup_args(run[k])
     if args[0].startswith("$"):
         search_context = args[0][1:]
         total = float(context[search_context])
@@ -584,8 +682,9 @@ def split_fert_dap_percent(k, run, context, _):
     return {k: out}
 
 
+@pure(_raster_value_inputs)
 def assign_by_raster_value(k, run, context, _):
-    init_args = run[k].split("::")[1:]
+    init_args = lookup_args(run[k])
     if "raster" in init_args:
         args = init_args[init_args.index("raster") + 2:]
     else:
@@ -606,8 +705,9 @@ def assign_by_raster_value(k, run, context, _):
         return None
 
 
+@pure(_raster_value_inputs)
 def date_from_doy_raster(k, run, context, _):
-    init_args = run[k].split("::")[1:]
+    init_args = lookup_args(run[k])
     if "raster" not in init_args:
         logging.error("date_from_doy_raster: No raster specified.")
         return None
@@ -623,8 +723,9 @@ def date_from_doy_raster(k, run, context, _):
     }
 
 
+@pure(_reference_inputs)
 def date_offset(k, run, context, _):
-    args = run[k].split("::")[1:]
+    args = lookup_args(run[k])
     offset_value = args[-1]
     try:
         offset_value = int(offset_value)
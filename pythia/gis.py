@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def euclidean_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calculates the euclidean distance between two lat/lon points.
@@ -17,3 +20,88 @@ def euclidean_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     if lat1 == lat2 and lon1 == lon2:
         return 0.0
     return (lat1 - lat2)**2 + (lon1 - lon2)**2
+
+
+def _quantize(values, bits):
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    low = np.nanmin(values)
+    span = np.nanmax(values) - low
+    if not np.isfinite(span) or span == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    scaled = np.nan_to_num((values - low) / span * ((1 << bits) - 1))
+    return scaled.astype(np.int64)
+
+
+def morton_index(x, y, bits=16):
+    """
+    Calculates the Z-order (Morton) curve position of points.
+
+    Args:
+        x, y: Arrays of coordinates, scaled to a 2**bits grid over their extent.
+        bits: Resolution of the grid in bits per axis.
+
+    Returns:
+        An int64 array with the curve position of every point.
+    """
+    xq = _quantize(x, bits)
+    yq = _quantize(y, bits)
+    index = np.zeros(len(xq), dtype=np.int64)
+    for bit in range(bits):
+        index |= ((xq >> bit) & 1) << (2 * bit)
+        index |= ((yq >> bit) & 1) << (2 * bit + 1)
+    return index
+
+
+def hilbert_index(x, y, bits=16):
+    """
+    Calculates the Hilbert curve position of points.
+
+    Consecutive positions are always adjacent grid cells, so points sorted by this
+    index stay spatially close along the whole ordering.
+
+    Args:
+        x, y: Arrays of coordinates, scaled to a 2**bits grid over their extent.
+        bits: Resolution of the grid in bits per axis.
+
+    Returns:
+        An int64 array with the curve position of every point.
+    """
+    xq = _quantize(x, bits)
+    yq = _quantize(y, bits)
+    n = 1 << bits
+    index = np.zeros(len(xq), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = ((xq & s) > 0).astype(np.int64)
+        ry = ((yq & s) > 0).astype(np.int64)
+        index += s * s * ((3 * rx) ^ ry)
+        flip = (ry == 0) & (rx == 1)
+        xq = np.where(flip, n - 1 - xq, xq)
+        yq = np.where(flip, n - 1 - yq, yq)
+        swap = ry == 0
+        xq, yq = np.where(swap, yq, xq), np.where(swap, xq, yq)
+        s >>= 1
+    return index
+
+
+def curve_order(x, y, curve):
+    """
+    Orders points along a space-filling curve.
+
+    Args:
+        x, y: Arrays of longitudes and latitudes.
+        curve: ``hilbert`` or ``zorder``.
+
+    Returns:
+        The indices that sort the points along the curve. Points at the same
+        position keep their original relative order.
+    """
+    if curve == "hilbert":
+        index = hilbert_index(x, y)
+    elif curve == "zorder":
+        index = morton_index(x, y)
+    else:
+        raise ValueError("Unknown pixel order: {}".format(curve))
+    return np.argsort(index, kind="stable")
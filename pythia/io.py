@@ -1,9 +1,15 @@
+import csv
+import logging
+import math
 import os
-import sys
+import shutil
 
 import fiona
+import numpy as np
 import numpy.ma as ma
 import rasterio
+import rtree.index
+from rasterio.transform import rowcol
 
 try:
     from functools import cache
@@ -13,6 +19,7 @@ except ImportError:
 from typing import Any, Dict, Tuple
 from pythia.gis import euclidean_distance
 
+import pythia.cache_manager
 import pythia.functions
 import pythia.util
 
@@ -34,47 +41,539 @@ def get_site_raster_value(dataset, band, site):
     return data
 
 
-def peer(run, sample_size=None):
-    rasters = pythia.util.get_rasters_dict(run)
-    sites = []
-    if isinstance(run["sites"], list):
-        sites = pythia.functions.xy_from_list(run["sites"])
-    else:
-        sites = pythia.functions.xy_from_vector(run["sites"])
-    data = []
-    layers = list(rasters.keys())
-    for raster in rasters.values():
-        with rasterio.open(raster) as ds:
-            band = ds.read(1, masked=True)
-            data.append([get_site_raster_value(ds, band, site) for site in sites])
-    peerless = list(
-        filter(
-            lambda x: x is not None,
-            [read_layer_by_cell(i, data, layers, sites) for i in range(len(sites))],
-        )
+def site_pixels(dataset, lng, lat):
+    """
+    Convert arrays of site coordinates into raster rows and columns in one call.
+
+    :param dataset: An open rasterio dataset.
+    :param lng: Array of site longitudes (x).
+    :param lat: Array of site latitudes (y).
+    :returns: A tuple of (rows, cols, inside), where `inside` flags the sites
+        that fall on the raster grid. Rows and columns of outside sites are 0.
+    """
+    lng = np.asarray(lng, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    rows = np.zeros(lng.shape, dtype=np.int64)
+    cols = np.zeros(lng.shape, dtype=np.int64)
+    inside = np.isfinite(lng) & np.isfinite(lat)
+    if inside.any():
+        r, c = rowcol(dataset.transform, lng[inside], lat[inside])
+        rows[inside] = np.asarray(r, dtype=np.int64)
+        cols[inside] = np.asarray(c, dtype=np.int64)
+    inside &= (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+    rows[~inside] = 0
+    cols[~inside] = 0
+    return rows, cols, inside
+
+
+def sample_pixels(dataset, rows, cols, band_index=1, windowed=True):
+    """
+    Gather band values at the given raster cells with NumPy fancy indexing.
+
+    In windowed mode the cells are grouped by the internal block that holds them
+    and only those blocks are read, so memory follows the number of cells rather
+    than the raster size.
+
+    :param dataset: An open rasterio dataset.
+    :param rows: Array of row indexes, all inside the raster.
+    :param cols: Array of column indexes, all inside the raster.
+    :param band_index: The band to sample.
+    :param windowed: Read only the touched blocks instead of the full band.
+    :returns: A tuple of (values, valid), where `valid` is False on masked cells.
+    """
+    values = np.zeros(len(rows), dtype=dataset.dtypes[band_index - 1])
+    valid = np.zeros(len(rows), dtype=bool)
+    if len(rows) == 0:
+        return values, valid
+    if not windowed:
+        band = dataset.read(band_index, masked=True)
+        values[:] = band.data[rows, cols]
+        valid[:] = ~ma.getmaskarray(band)[rows, cols]
+        return values, valid
+
+    block_rows, block_cols = dataset.block_shapes[band_index - 1]
+    blocks_per_row = -(-dataset.width // block_cols)
+    keys = (rows // block_rows) * blocks_per_row + cols // block_cols
+    order = np.argsort(keys, kind="stable")
+    block_keys, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for key, start, end in zip(block_keys, starts, ends):
+        members = order[start:end]
+        window = dataset.block_window(band_index, *divmod(int(key), blocks_per_row))
+        data = dataset.read(band_index, window=window, masked=True)
+        r = rows[members] - int(window.row_off)
+        c = cols[members] - int(window.col_off)
+        values[members] = data.data[r, c]
+        valid[members] = ~ma.getmaskarray(data)[r, c]
+    return values, valid
+
+
+def sample_sites(dataset, lng, lat, band_index=1, windowed=True):
+    """
+    Sample a raster band at arrays of site coordinates.
+
+    :returns: A tuple of (values, valid), where `valid` is False for sites outside
+        the raster or on masked cells.
+    """
+    rows, cols, inside = site_pixels(dataset, lng, lat)
+    values = np.zeros(len(rows), dtype=dataset.dtypes[band_index - 1])
+    valid = np.zeros(len(rows), dtype=bool)
+    values[inside], valid[inside] = sample_pixels(
+        dataset, rows[inside], cols[inside], band_index, windowed
     )
-    return peerless[:sample_size]
+    return values, valid
 
 
-def read_layer_by_cell(idx, data, layers, sites):
-    if data is None:
-        return None
-    lng, lat = sites[idx]
+def coords_to_arrays(coords):
+    """Split a sequence of (longitude, latitude[, ...]) pairs into two arrays."""
+    if isinstance(coords, np.ndarray):
+        return coords[:, 0].astype(float), coords[:, 1].astype(float)
+    lng = np.fromiter((c[0] for c in coords), dtype=float, count=len(coords))
+    lat = np.fromiter((c[1] for c in coords), dtype=float, count=len(coords))
+    return lng, lat
+
+
+def site_arrays(sites):
+    """
+    Load the `sites` entry of a run as arrays of longitudes and latitudes. A
+    string entry names its site function, e.g. `xy_from_vector::<file>`.
+    """
+    if isinstance(sites, list):
+        return coords_to_arrays(pythia.functions.xy_from_list(sites))
+    fn = sites.split("::")[0]
+    return coords_to_arrays(getattr(pythia.functions, fn)(sites))
+
+
+def record_to_cell(layers, record):
+    """Expand a PixelTable record into the per-pixel dictionary used as context."""
+    lng, lat = record[0], record[1]
     cell = {"lat": lat, "lng": lng, "xcrd": lng, "ycrd": lat}
-    for i, c in enumerate(data):
-        if c[idx] is None:
-            return None
-        if layers[i] == "harvestArea" and c[idx] == 0:
-            return None
-        else:
-            cell[layers[i]] = c[idx]
+    for layer, value in zip(layers, record[2:]):
+        cell[layer] = value
     return cell
 
 
+class PixelTable:
+    """
+    Columnar table of the pixels selected for a run.
+
+    Coordinates and layer values are kept as aligned NumPy arrays. The per-pixel
+    dictionaries consumed by the context builder are only created when a row is
+    accessed, either by iterating over the table or by integer indexing.
+    """
+
+    def __init__(self, lng, lat, layers=None, members=None):
+        self.lng = np.asarray(lng, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.layers = dict(layers or {})
+        # (lng, lat, owner) arrays of the sites merged into each pixel by
+        # snapping, where owner is the row of the pixel. None when not snapped.
+        self.members = members
+
+    def __len__(self):
+        return len(self.lng)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.cell(idx)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.cell(key)
+        return self.take(key)
+
+    def cell(self, idx):
+        return record_to_cell(list(self.layers), self.record(idx))
+
+    def record(self, idx):
+        """A compact (lng, lat, *layer values) tuple for the pixel at `idx`."""
+        return (float(self.lng[idx]), float(self.lat[idx])) + tuple(
+            values[idx] for values in self.layers.values()
+        )
+
+    def take(self, indices):
+        members = None
+        if self.members is not None:
+            rows = np.arange(len(self))[indices]
+            remap = np.full(len(self), -1, dtype=np.int64)
+            remap[rows] = np.arange(len(rows))
+            lng, lat, owner = self.members
+            owner = remap[owner]
+            kept = owner >= 0
+            members = (lng[kept], lat[kept], owner[kept])
+        return PixelTable(
+            self.lng[indices],
+            self.lat[indices],
+            {layer: values[indices] for layer, values in self.layers.items()},
+            members,
+        )
+
+    def member_sites(self):
+        """
+        The sites merged into each snapped pixel.
+
+        :returns: A dictionary of row to a list of (lat, lng) site tuples, empty
+            when the table was not snapped.
+        """
+        sites = {}
+        if self.members is None:
+            return sites
+        lng, lat, owner = self.members
+        for site_lng, site_lat, row in zip(lng.tolist(), lat.tolist(), owner.tolist()):
+            sites.setdefault(row, []).append((site_lat, site_lng))
+        return sites
+
+
+def snap_sites(lng, lat, grid):
+    """
+    Move sites to the center of the `grid` raster cell holding them, merging
+    the sites that share a cell. Sites outside the grid are dropped.
+
+    :returns: A tuple of (lng, lat, members) where lng and lat are the cell
+        centers in order of their first site and members is an (lng, lat, owner)
+        tuple of the original sites and the index of their cell.
+    """
+    lng = np.asarray(lng, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    with rasterio.open(grid) as ds:
+        rows, cols, inside = site_pixels(ds, lng, lat)
+        width = ds.width
+        transform = ds.transform
+    selected = np.flatnonzero(inside)
+    cells = rows[selected] * width + cols[selected]
+    unique_cells, first, owner = np.unique(cells, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    cell_rows, cell_cols = np.divmod(unique_cells[order], width)
+    centers_lng = transform.c + (cell_cols + 0.5) * transform.a + (cell_rows + 0.5) * transform.b
+    centers_lat = transform.f + (cell_cols + 0.5) * transform.d + (cell_rows + 0.5) * transform.e
+    members = (lng[selected], lat[selected], rank[owner.ravel()])
+    return centers_lng, centers_lat, members
+
+
+def grid_tiles(grid, lng, lat, tile_size):
+    """
+    The tile of the `grid` raster holding each site, numbering square tiles of
+    `tile_size` cells in row-major order. Sites outside the grid are in tile -1.
+    """
+    with rasterio.open(grid) as ds:
+        rows, cols, inside = site_pixels(ds, lng, lat)
+        tiles_per_row = -(-ds.width // tile_size)
+    tiles = (rows // tile_size) * tiles_per_row + cols // tile_size
+    tiles[~inside] = -1
+    return tiles
+
+
+def snap_grid(run, snap):
+    """
+    The raster whose grid the sites of `run` snap to for a ``snapToGrid``
+    setting: the given raster, or for `True` the run's ``harvestArea`` or first
+    raster layer. None when snapping is off or the run has no raster.
+    """
+    if not snap:
+        return None
+    if isinstance(snap, str):
+        return snap
+    rasters = pythia.util.get_rasters_dict(run)
+    if "harvestArea" in rasters:
+        return rasters["harvestArea"]
+    return next(iter(rasters.values()), None)
+
+
+def estimate_valid_fraction(dataset, band_index=1):
+    """
+    Estimate the share of unmasked cells in a band from its smallest overview.
+
+    :returns: A fraction between 0 and 1, or None when the band has no overviews
+        and an estimate would require reading the full band.
+    """
+    factors = dataset.overviews(band_index)
+    if not factors:
+        return None
+    factor = max(factors)
+    shape = (max(1, dataset.height // factor), max(1, dataset.width // factor))
+    preview = dataset.read(band_index, out_shape=shape, masked=True)
+    return float(preview.count()) / preview.size
+
+
+class SiteSampler:
+    """
+    Samples rasters at the sites of one site source and remembers every value read.
+
+    Runs that share a site source hand the same sampler to `peer`, so each
+    (site, raster) pair is read at most once no matter how many runs use it.
+    """
+
+    def __init__(self, lng, lat, windowed=True, cube=None, members=None):
+        self.lng = np.asarray(lng, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.members = members
+        self.windowed = windowed
+        self.cube = cube
+        self._cube_pixels = None
+        self._samples = {}
+        self._estimates = {}
+
+    @classmethod
+    def from_sites(cls, sites, windowed=True, cube=None, grid=None):
+        """
+        Load a `sites` entry, snapping the sites to the cells of the `grid`
+        raster when given.
+        """
+        lng, lat = site_arrays(sites)
+        members = None
+        if grid is not None:
+            lng, lat, members = snap_sites(lng, lat, grid)
+        return cls(lng, lat, windowed=windowed, cube=cube, members=members)
+
+    def __len__(self):
+        return len(self.lng)
+
+    def valid_fraction(self, raster):
+        if raster not in self._estimates:
+            with rasterio.open(raster) as ds:
+                self._estimates[raster] = estimate_valid_fraction(ds)
+        return self._estimates[raster]
+
+    def sample(self, raster, indices):
+        """
+        Sample `raster` at the sites in `indices`, reading only the sites that
+        were not sampled before.
+
+        :returns: A tuple of (values, valid) aligned with `indices`.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        entry = self._samples.get(raster)
+        missing = indices if entry is None else indices[~entry[2][indices]]
+        cube_band = self.cube.band_for(raster) if self.cube is not None else None
+        if cube_band is not None:
+            if entry is None:
+                entry = (
+                    np.zeros(len(self), dtype=cube_band[1]),
+                    np.zeros(len(self), dtype=bool),
+                    np.zeros(len(self), dtype=bool),
+                )
+                self._samples[raster] = entry
+            if len(missing):
+                if self._cube_pixels is None:
+                    self._cube_pixels = self.cube.pixels(self.lng, self.lat)
+                rows, cols, inside = self._cube_pixels
+                hits = missing[inside[missing]]
+                values, valid = self.cube.sample(
+                    cube_band[0], cube_band[1], rows[hits], cols[hits], self.windowed
+                )
+                entry[0][hits] = values
+                entry[1][hits] = valid
+                entry[2][missing] = True
+        elif entry is None or len(missing):
+            with rasterio.open(raster) as ds:
+                if entry is None:
+                    entry = (
+                        np.zeros(len(self), dtype=ds.dtypes[0]),
+                        np.zeros(len(self), dtype=bool),
+                        np.zeros(len(self), dtype=bool),
+                    )
+                    self._samples[raster] = entry
+                values, valid = sample_sites(
+                    ds, self.lng[missing], self.lat[missing], windowed=self.windowed
+                )
+            entry[0][missing] = values
+            entry[1][missing] = valid
+            entry[2][missing] = True
+        return entry[0][indices], entry[1][indices]
+
+
+def sites_key(sites):
+    """A hashable key identifying a `sites` entry, used to share SiteSamplers."""
+    if isinstance(sites, list):
+        return tuple(tuple(site) for site in sites)
+    return sites
+
+
+def _sampling_order(rasters, sampler):
+    """
+    Order layers so the most selective ones are sampled first: `harvestArea`,
+    then layers by their estimated share of valid cells, then the rest in the
+    order they were declared.
+    """
+    estimates = {
+        layer: sampler.valid_fraction(raster)
+        for layer, raster in rasters.items()
+        if layer != "harvestArea"
+    }
+    layers = list(rasters.keys())
+
+    def _key(layer):
+        if layer == "harvestArea":
+            return (0, 0.0, layers.index(layer))
+        estimate = estimates[layer]
+        if estimate is None:
+            return (2, 0.0, layers.index(layer))
+        return (1, estimate, layers.index(layer))
+
+    return sorted(layers, key=_key)
+
+
+def peer(run, sample_size=None, sampling="windowed", sampler=None):
+    """
+    Sample every `raster::` layer of a run at its sites.
+
+    Layers are sampled mask-first: each layer is only read for the sites that
+    survived the previous ones, so a zero `harvestArea` or a nodata cell stops a
+    site from costing any further raster reads.
+
+    :param run: The merged run configuration.
+    :param sample_size: Keep only the first `sample_size` valid pixels.
+    :param sampling: `windowed` to read only the blocks holding sites, `band` to
+        read complete bands.
+    :param sampler: A SiteSampler for the run's sites, shared with other runs
+        that use the same site source.
+    :returns: A PixelTable of the valid pixels.
+    """
+    if sampler is None:
+        sampler = SiteSampler.from_sites(run["sites"], windowed=sampling != "band")
+    rasters = pythia.util.get_rasters_dict(run)
+    active = np.arange(len(sampler))
+    columns = {}
+    for layer in _sampling_order(rasters, sampler):
+        values, valid = sampler.sample(rasters[layer], active)
+        if layer == "harvestArea":
+            valid &= values != 0
+        column = np.zeros(len(sampler), dtype=values.dtype)
+        column[active] = values
+        columns[layer] = column
+        active = active[valid]
+    table = PixelTable(
+        sampler.lng,
+        sampler.lat,
+        {layer: columns[layer] for layer in rasters},
+        sampler.members,
+    )
+    return table.take(active[:sample_size])
+
+
+def peer_runs(runs, sample_size=None, sampling="windowed", cube=None, snap=None):
+    """
+    Peer every run, loading each site source once and sampling each
+    (site source, raster) pair once across all of the runs.
+
+    :param cube: An optional RasterCube serving every layer it contains.
+    :param snap: The ``snapToGrid`` setting, merging the sites that fall in the
+        same cell of the grid returned by `snap_grid` into one pixel.
+    :returns: A list of PixelTables aligned with `runs`.
+    """
+    samplers = {}
+    peers = []
+    for run in runs:
+        grid = snap_grid(run, snap)
+        key = (sites_key(run["sites"]), grid)
+        if key not in samplers:
+            samplers[key] = SiteSampler.from_sites(
+                run["sites"], windowed=sampling != "band", cube=cube, grid=grid
+            )
+        peers.append(peer(run, sample_size, sampling, samplers[key]))
+    return peers
+
+
 def make_run_directory(rd):
     os.makedirs(rd, exist_ok=True)
 
 
+PIXEL_MEMBERS_FILE = "pixel_members.csv"
+
+
+def pixel_members_file(run_dir):
+    return os.path.join(run_dir, PIXEL_MEMBERS_FILE)
+
+
+class PixelMembersWriter:
+    """
+    Record the sites simulated by the pixel directories of runs, appending to
+    the members file of each run as setup proceeds.
+
+    :param run_dirs: The run directories. Their members files are removed,
+        unless a size is given for them in `sizes`.
+    :param sizes: The sizes in bytes to truncate members files to, when a setup
+        resumes after the rows it had already recorded.
+    """
+
+    def __init__(self, run_dirs, sizes=None):
+        self.files = {}
+        self.count = 0
+        sizes = sizes or {}
+        for run_dir in run_dirs:
+            path = pixel_members_file(run_dir)
+            if not os.path.exists(path):
+                continue
+            if run_dir in sizes:
+                with open(path, "r+") as f:
+                    f.truncate(sizes[run_dir])
+            else:
+                os.remove(path)
+
+    def write(self, run_dir, members):
+        """
+        Append the sites of pixel directories of a run.
+
+        :param members: (directory, lat, lng) tuples, one per site.
+        """
+        if run_dir not in self.files:
+            path = pixel_members_file(run_dir)
+            header = not os.path.exists(path)
+            f = open(path, "a", newline="")
+            self.files[run_dir] = (f, csv.writer(f))
+            if header:
+                self.files[run_dir][1].writerow(["dir", "lat", "lng"])
+        writer = self.files[run_dir][1]
+        for directory, lat, lng in members:
+            writer.writerow([directory, "{:.4f}".format(lat), "{:.4f}".format(lng)])
+            self.count += 1
+
+    def sizes(self):
+        """The size of every members file written so far, after flushing it."""
+        sizes = {}
+        for run_dir, (f, _) in self.files.items():
+            f.flush()
+            sizes[run_dir] = os.path.getsize(f.name)
+        return sizes
+
+    def close(self):
+        for f, _ in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def read_pixel_members(run_dir):
+    """
+    The sites recorded for the pixel directories of a run.
+
+    :returns: A dictionary of absolute directory to a list of (lat, lng) strings.
+    """
+    members = {}
+    path = pixel_members_file(run_dir)
+    if not os.path.exists(path):
+        return members
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            members.setdefault(os.path.abspath(row["dir"]), []).append(
+                (row["lat"], row["lng"])
+            )
+    return members
+
+
+def read_pixel_locations(run_dirs):
+    """
+    The (lat, lng) of the pixel directories recorded in the members files of
+    `run_dirs`, using the first site of each directory.
+    """
+    locations = {}
+    for run_dir in run_dirs:
+        for directory, sites in read_pixel_members(run_dir).items():
+            locations[directory] = (float(sites[0][0]), float(sites[0][1]))
+    return locations
+
+
 def get_rio_profile(f):
     with rasterio.open(f) as source:
         profile = source.profile
@@ -93,19 +592,136 @@ def index_points_ids(file: str, id_field: str) -> Dict[Tuple[float, float], Any]
     :param file: Path to the GIS file (e.g., Shapefile, GeoJSON).
     :param id_field: Property field name whose values are mapped to coordinates.
     :returns: A dictionary with (longitude, latitude) keys and `id_field` values.
+        The first point in the file wins when coordinates repeat.
     """
+    coords, ids = vector_points(file, id_field)
     coords_map = {}
-    with fiona.open(file, "r") as source:
-        for feature in source:
-            if feature["geometry"]["type"] == "MultiPoint":
-                for coords in feature["geometry"]["coordinates"]:
-                    coords_map[(coords[0], coords[1])] = feature["properties"][id_field]
-            if feature["geometry"]["type"] == "Point":
-                coords = feature["geometry"]["coordinates"]
-                coords_map[(coords[0], coords[1])] = feature["properties"][id_field]
+    for key, value in zip(map(tuple, coords.tolist()), _to_list(ids)):
+        coords_map.setdefault(key, value)
+    return coords_map
+
+
+def extract_raster_coords(f, threshold=None):
+    """
+    Collect the cell-center coordinates of the selected cells of a mask raster,
+    reading it one block at a time.
+
+    :param f: Path to the mask raster.
+    :param threshold: Select cells greater than this value; by default every
+        nonzero cell is selected. Masked cells are never selected.
+    :returns: An (N, 2) array of (longitude, latitude) pairs in row-major order.
+    """
+    rows = []
+    cols = []
+    with rasterio.open(f) as ds:
+        for _, window in ds.block_windows(1):
+            data = ds.read(1, window=window, masked=True)
+            if threshold is None:
+                selected = data.filled(0) != 0
+            else:
+                selected = ~ma.getmaskarray(data) & (data.data > threshold)
+            r, c = np.nonzero(selected)
+            rows.append(r + int(window.row_off))
+            cols.append(c + int(window.col_off))
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((cols, rows))
+        rows = rows[order]
+        cols = cols[order]
+        transform = ds.transform
+    xs = transform.c + (cols + 0.5) * transform.a + (rows + 0.5) * transform.b
+    ys = transform.f + (cols + 0.5) * transform.d + (rows + 0.5) * transform.e
+    return np.column_stack((xs, ys))
+
+
+_TABLE_LNG_COLUMNS = ("lng", "lon", "long", "longitude", "x")
+_TABLE_LAT_COLUMNS = ("lat", "latitude", "y")
+
+
+@cache
+def load_table(file: str) -> Dict[str, Any]:
+    """
+    Load a site table into a mapping of column names to NumPy arrays.
+
+    CSV files need a header row. `.npz` files map each stored array to a column,
+    and `.npy` files hold either a structured array or a plain 2D array whose
+    first two columns are longitude and latitude.
+
+    :param file: Path to a `.csv`, `.npy` or `.npz` file.
+    :returns: A dictionary of column name to array.
+    """
+    ext = os.path.splitext(file)[1].lower()
+    if ext == ".npz":
+        with np.load(file, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    if ext == ".npy":
+        data = np.load(file, allow_pickle=False)
+        if data.dtype.names:
+            return {name: data[name] for name in data.dtype.names}
+        columns = {"lng": data[:, 0], "lat": data[:, 1]}
+        for idx in range(2, data.shape[1]):
+            columns["col{}".format(idx)] = data[:, idx]
+        return columns
+    with open(file, newline="") as source:
+        reader = csv.reader(source)
+        header = [name.strip() for name in next(reader)]
+        # csv yields an empty row for blank lines, e.g. a trailing one.
+        rows = [row for row in reader if row]
+    return {name: np.array([row[idx] for row in rows]) for idx, name in enumerate(header)}
+
+
+def _table_column(columns, candidates, file):
+    lookup = {name.lower(): name for name in columns}
+    for candidate in candidates:
+        if candidate in lookup:
+            return columns[lookup[candidate]]
+    raise ValueError(
+        "{} needs one of the columns: {}".format(file, ", ".join(candidates))
+    )
+
+
+def table_coords(file):
+    """The longitude and latitude arrays of a site table."""
+    columns = load_table(file)
+    lng = _table_column(columns, _TABLE_LNG_COLUMNS, file).astype(float)
+    lat = _table_column(columns, _TABLE_LAT_COLUMNS, file).astype(float)
+    return lng, lat
+
+
+def extract_table_coords(f):
+    """
+    Bulk-load the coordinates of a site table.
+
+    :returns: An (N, 2) array of (longitude, latitude) pairs in table order.
+    """
+    return np.column_stack(table_coords(f))
+
+
+@cache
+def index_table_ids(file: str, id_field: str) -> Dict[Tuple[float, float], Any]:
+    """
+    Create a mapping of (lon, lat) coordinates to the `id_field` values of a site
+    table. The first row wins when coordinates repeat.
+    """
+    lng, lat = table_coords(file)
+    ids = load_table(file)[id_field].tolist()
+    coords_map = {}
+    for key, value in zip(zip(lng.tolist(), lat.tolist()), ids):
+        coords_map.setdefault(key, value)
     return coords_map
 
 
+def find_closest_table_coords(f, lng, lat, a):
+    """
+    Find the `a` value of the table row at (lng, lat), falling back to the
+    closest row. Ties resolve to the first row in the table.
+    """
+    lookup = index_table_ids(f, a).get((lng, lat))
+    if lookup is not None:
+        return lookup
+    return table_point_index(f, a).nearest(lng, lat)
+
+
 def extract_vector_coords(f):
     points = []
     with fiona.open(f, "r") as source:
@@ -129,29 +745,155 @@ def find_vector_coords(f, lng, lat, a):
                     return feature["properties"][a]
 
 
+class PointIndex:
+    """
+    Nearest-neighbour index of the points of a vector file.
+
+    Points are numbered in file order, MultiPoint members in their own order,
+    and a query returns the `ids` value of the first of the closest points.
+    """
+
+    def __init__(self, coords, ids):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.ids = ids
+        # Bulk-loaded from the coordinates, which takes a fraction of the time
+        # of reading them from the vector file.
+        self.tree = None
+        if len(self.coords):
+            self.tree = rtree.index.Index(
+                (idx, (x, y, x, y), None)
+                for idx, (x, y) in enumerate(self.coords.tolist())
+            )
+
+    def __len__(self):
+        return len(self.coords)
+
+    def nearest(self, lng, lat):
+        if self.tree is None:
+            return None
+        closest = next(self.tree.nearest((lng, lat, lng, lat), 1))
+        # Gather every point as close as the R-tree's answer, then break ties
+        # on the scan distance and file order.
+        radius = math.sqrt(self._distance(closest, lng, lat)) * (1 + 1e-9) + 1e-12
+        candidates = self.tree.intersection(
+            (lng - radius, lat - radius, lng + radius, lat + radius)
+        )
+        best = min(
+            candidates, key=lambda idx: (self._distance(idx, lng, lat), idx)
+        )
+        value = self.ids[best]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def _distance(self, idx, lng, lat):
+        x, y = self.coords[idx].tolist()
+        return euclidean_distance(y, x, lat, lng)
+
+
+def read_vector_points(file, id_field):
+    """
+    The points of a vector file with the `id_field` value of their feature.
+
+    :returns: An (N, 2) array of (longitude, latitude) pairs in file order and
+        the list of their ids.
+    """
+    coords = []
+    ids = []
+    with fiona.open(file, "r") as source:
+        for feature in source:
+            geometry = feature["geometry"]
+            if geometry is None:
+                continue
+            if geometry["type"] == "MultiPoint":
+                points = geometry["coordinates"]
+            elif geometry["type"] == "Point":
+                points = [geometry["coordinates"]]
+            else:
+                continue
+            for point in points:
+                coords.append((point[0], point[1]))
+                ids.append(feature["properties"][id_field])
+    return np.array(coords, dtype=float).reshape(-1, 2), ids
+
+
+def _to_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+# Directory of the persisted vector point indexes, see `configure_vector_cache`.
+_vector_cache = {"dir": None}
+
+
+def configure_vector_cache(cache_dir):
+    """
+    Persist the points read from vector files under ``<cache_dir>/vectors/`` and
+    memory-map them in later processes, or read every vector file again in each
+    process when `cache_dir` is None.
+    """
+    _vector_cache["dir"] = cache_dir
+
+
+def _vector_cache_dir(file, id_field):
+    signatures = [pythia.cache_manager.file_signature(file)]
+    attributes = os.path.splitext(file)[0] + ".dbf"
+    if attributes != file and os.path.exists(attributes):
+        signatures.append(pythia.cache_manager.file_signature(attributes))
+    key = pythia.cache_manager.fingerprint(["points", signatures, id_field])
+    return os.path.join(_vector_cache["dir"], "vectors", key)
+
+
+def _save_vector_points(target, coords, ids):
+    ids = np.asarray(ids)
+    if ids.dtype == object:
+        logging.debug("[VECTOR] Not caching the mixed ids of %s", target)
+        return
+    tmp_dir = "{}.{}.tmp".format(target, os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "coords.npy"), coords)
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+    if os.path.exists(target):
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, target)
+
+
+@cache
+def vector_points(file: str, id_field: str):
+    """
+    `read_vector_points`, memory-mapped from the vector cache when one is
+    configured. The cache is keyed by the path, size and modification time of
+    the file (and of its ``.dbf``) and by `id_field`.
+    """
+    if _vector_cache["dir"] is None:
+        return read_vector_points(file, id_field)
+    target = _vector_cache_dir(file, id_field)
+    if os.path.exists(os.path.join(target, "ids.npy")):
+        return (
+            np.load(os.path.join(target, "coords.npy"), mmap_mode="r"),
+            np.load(os.path.join(target, "ids.npy"), mmap_mode="r"),
+        )
+    coords, ids = read_vector_points(file, id_field)
+    _save_vector_points(target, coords, ids)
+    return coords, ids
+
+
+@cache
+def point_index(file: str, id_field: str) -> PointIndex:
+    """The `PointIndex` of a vector file, built once per process."""
+    return PointIndex(*vector_points(file, id_field))
+
+
+@cache
+def table_point_index(file: str, id_field: str) -> PointIndex:
+    """The `PointIndex` of a site table, built once per process."""
+    return PointIndex(extract_table_coords(file), load_table(file)[id_field])
+
+
 def find_closest_vector_coords(f, lng, lat, a):
-    lookup = index_points_ids(f, a)[(lng, lat)]
+    """
+    Find the `a` value of the point at (lng, lat), falling back to the closest
+    point. Ties resolve to the first point in the file.
+    """
+    lookup = index_points_ids(f, a).get((lng, lat))
     if lookup is not None:
         return lookup
-
-    closest_id = None
-    with fiona.open(f, "r") as source:
-        closest_distance = sys.float_info.max
-        for feature in source:
-            if feature["geometry"]["type"] == "MultiPoint":
-                for coords in feature["geometry"]["coordinates"]:
-                    res = euclidean_distance(coords[1], coords[0], lat, lng)
-                    if res < closest_distance:
-                        closest_distance = res
-                        closest_id = feature["properties"][a]
-                    if res == 0:
-                        break
-            if feature["geometry"]["type"] == "Point":
-                coords = feature["geometry"]["coordinates"]
-                res = euclidean_distance(coords[1], coords[0], lat, lng)
-                if res < closest_distance:
-                    closest_distance = res
-                    closest_id = feature["properties"][a]
-                if res == 0:
-                    return feature["properties"][a]
-    return closest_id
+    return point_index(f, a).nearest(lng, lat)
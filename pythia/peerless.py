@@ -1,32 +1,44 @@
+import json
 import logging
 import multiprocessing as mp
-import concurrent.futures
+import multiprocessing.util
 import os
+import shutil
 
+import numpy as np
+
+import pythia.cache_manager
+import pythia.context
+import pythia.context_store
+import pythia.executors
 import pythia.functions
+import pythia.gis
 import pythia.io
+import pythia.plan
 import pythia.plugin
+import pythia.shared_rasters
 import pythia.template
 import pythia.util
 
 
-def build_context(run, ctx, config, plugins):
+def build_context(run, ctx, config, plugins, plan=None, run_idx=None, pixel_id=None):
     if not config["silence"]:
         print("+", end="", flush=True)
-    context = run.copy()
-    context = {**context, **ctx}
-    y, x = pythia.util.translate_coords_news(context["lat"], context["lng"])
-    context["contextWorkDir"] = os.path.join(context["workDir"], y, x)
-    for k, v in run.items():
-        if "::" in str(v) and k != "sites":
-            fn = v.split("::")[0]
-            if fn != "raster":
-                res = getattr(pythia.functions, fn)(k, run, context, config)
-                if res is not None:
-                    context = {**context, **res}
-                else:
-                    context = None
-                    break
+    if plan is None:
+        plan = pythia.plan.compile_run(run)
+    # The run is shared by every pixel, only the pixel values are stored.
+    context = pythia.context.PixelContext(run, dict(ctx), run_idx)
+    context["contextWorkDir"] = os.path.join(
+        context["workDir"],
+        *pythia.util.pixel_dir_parts(config, context["lat"], context["lng"], pixel_id),
+    )
+    for step in plan:
+        res = pythia.plan.call_step(step, run, context, config)
+        if res is not None:
+            context.update(res)
+        else:
+            context = None
+            break
 
     hook = pythia.plugin.PluginHook.post_peerless_pixel_success
     if context is None:
@@ -42,10 +54,289 @@ def build_context(run, ctx, config, plugins):
     return context
 
 
-def _generate_context_args(runs, peers, config, plugins):
-    for idx, run in enumerate(runs):
-        for peer in peers[idx]:
-            yield run, peer, config, plugins
+# Per-process state of the setup workers, filled once by _init_worker so tasks
+# only carry a run index and a compact pixel record.
+_worker = {}
+
+
+def _init_worker(config, plugins, layers, plans):
+    _worker["config"] = config
+    _worker["plugins"] = plugins
+    _worker["runs"] = config.get("runs", [])
+    _worker["layers"] = layers
+    _worker["plans"] = plans
+    pythia.context.register_runs(_worker["runs"])
+    pythia.plan.configure_cache(config.get("lookupCacheSize", 4096))
+    if config.get("vectorIndexCache", True):
+        pythia.io.configure_vector_cache(pythia.cache_manager.cache_dir(config))
+    multiprocessing.util.Finalize(None, pythia.plan.log_cache_stats, exitpriority=10)
+    multiprocessing.util.Finalize(None, pythia.context_store.close, exitpriority=10)
+    if config.get("renderInWorkers", False):
+        _worker["env"] = pythia.template.init_engine(config["templateDir"])
+
+
+def _build_context_task(run_idx, record, pixel_id=None, tile=None):
+    ctx = pythia.io.record_to_cell(_worker["layers"][run_idx], record)
+    context = build_context(
+        _worker["runs"][run_idx],
+        ctx,
+        _worker["config"],
+        _worker["plugins"],
+        _worker["plans"][run_idx],
+        run_idx,
+        pixel_id,
+    )
+    config = _worker["config"]
+    # Collapsed setups only store the contexts the parent keeps, see
+    # _SetupResults.add_context.
+    if (
+        context is not None
+        and config.get("contextStore", False)
+        and not config.get("collapseIdentical", False)
+    ):
+        pythia.context_store.save(config, context, tile)
+    return context
+
+
+def _render_context_task(run_idx, record, pixel_id=None, tile=None):
+    context = _build_context_task(run_idx, record, pixel_id, tile)
+    # Skipped pixels are dropped like in the parent, without the skip hook.
+    if context is None:
+        return None
+    return process_context(
+        context, _worker["plugins"], _worker["config"], _worker["env"]
+    )
+
+
+# Context keys that locate a pixel without changing its simulation.
+COLLAPSE_IGNORE = ("lat", "lng", "xcrd", "ycrd", "contextWorkDir")
+
+
+def _collapse_key(context, ignore):
+    """A key shared by the contexts that only differ in the `ignore` keys."""
+    return pythia.cache_manager.fingerprint(
+        {k: v for k, v in context.items() if k not in ignore}
+    )
+
+
+def _pixel_dir(config, work_dir, lat, lng, pixel_id=None):
+    return os.path.abspath(
+        os.path.join(work_dir, *pythia.util.pixel_dir_parts(config, lat, lng, pixel_id))
+    )
+
+
+def _snapped_sites(runs, peers):
+    """The sites merged into each snapped pixel, by run and (lat, lng) of the pixel."""
+    snapped = {}
+    for run, peer in zip(runs, peers):
+        snapped[run["workDir"]] = {
+            (float(peer.lat[row]), float(peer.lng[row])): sites
+            for row, sites in peer.member_sites().items()
+        }
+    return snapped
+
+
+def _vector_lookups(runs):
+    """The (file, id field) of every ``vector`` lookup of `runs`."""
+    lookups = []
+    for run in runs:
+        for v in run.values():
+            if not isinstance(v, str) or "::vector::" not in v:
+                continue
+            args = pythia.functions.lookup_args(v)
+            idx = args.index("vector")
+            if (args[idx + 1], args[idx + 2]) not in lookups:
+                lookups.append((args[idx + 1], args[idx + 2]))
+    return lookups
+
+
+def _index_vectors(config, runs):
+    """Persist the point index of every vector lookup before the workers map it."""
+    pythia.io.configure_vector_cache(pythia.cache_manager.cache_dir(config))
+    for file, id_field in _vector_lookups(runs):
+        logging.info("[PEERLESS] Indexing %s by %s", file, id_field)
+        pythia.io.vector_points(file, id_field)
+
+
+def _generate_tasks(peers, selection=None, tile=None):
+    """
+    Yield a (run index, pixel record, pixel id, tile) task for every pixel, or
+    for the rows listed by run index in `selection`. The pixel id is the row of
+    the pixel in the table of its run.
+    """
+    if selection is None:
+        selection = {idx: range(len(peer)) for idx, peer in enumerate(peers)}
+    for idx, rows in selection.items():
+        peer = peers[idx]
+        for row in rows:
+            yield idx, peer.record(row), int(row), tile
+
+
+class _SetupResults:
+    """
+    The run list and pixel members collected during setup, with the share of
+    the current tile kept apart for its checkpoint. Pixel members are streamed
+    to the members file of each run.
+    """
+
+    def __init__(self, runs, peers, config, collapse_ignore=None):
+        self.runs = runs
+        self.runlist = []
+        self.representatives = {}
+        self.collapse_ignore = collapse_ignore
+        self.snapped = _snapped_sites(runs, peers)
+        # Sharded directories do not encode their coordinates, every pixel is
+        # recorded with its own sites.
+        self.sharded = config.get("workDirLayout", "coords") == "sharded"
+        self.config = config
+        self.members = None
+        self.tile = None
+        self.tile_id = None
+
+    def open_members(self, state=None):
+        """Start the members files, or resume them from a tile checkpoint."""
+        state = state or {}
+        self.members = pythia.io.PixelMembersWriter(
+            [run["workDir"] for run in self.runs], state.get("sizes")
+        )
+        self.members.count = state.get("count", 0)
+
+    def close_members(self):
+        self.members.close()
+
+    def start_tile(self, tile):
+        self.tile_id = tile
+        self.tile = {"runlist": [], "representatives": {}}
+
+    def finish_tile(self):
+        """The checkpoint of the current tile."""
+        return {
+            **self.tile,
+            "members": {"sizes": self.members.sizes(), "count": self.members.count},
+        }
+
+    def restore_tile(self, tile):
+        self.runlist.extend(tile["runlist"])
+        self.representatives.update(tile["representatives"])
+
+    def tasks(self, peers, selection=None, tile=None):
+        """
+        `_generate_tasks`, recording the sites of every pixel directory as its
+        task is handed out unless pixels are collapsed.
+        """
+        for task in _generate_tasks(peers, selection, tile):
+            if self.collapse_ignore is None:
+                self._add_pixel(*task[:3])
+            yield task
+
+    def _add_pixel(self, run_idx, record, pixel_id):
+        work_dir = self.runs[run_idx]["workDir"]
+        lng, lat = record[0], record[1]
+        sites = self.snapped[work_dir].get((lat, lng))
+        if sites is None:
+            if not self.sharded:
+                return
+            sites = [(lat, lng)]
+        directory = _pixel_dir(self.config, work_dir, lat, lng, pixel_id)
+        self.members.write(work_dir, ((directory, *site) for site in sites))
+
+    def add_path(self, path):
+        if path is None:
+            return
+        self.runlist.append(path)
+        if self.tile is not None:
+            self.tile["runlist"].append(path)
+
+    def add_context(self, context, plugins, config, env):
+        """Write the pixel directory of a built context, or collapse it into
+        the directory of an identical one."""
+        if self.collapse_ignore is None:
+            self.add_path(process_context(context, plugins, config, env))
+            return
+        key = _collapse_key(context, self.collapse_ignore)
+        representative = self.representatives.get(key)
+        if representative is None:
+            if config.get("contextStore", False):
+                pythia.context_store.save(config, context, self.tile_id)
+            representative = process_context(context, plugins, config, env)
+            if representative is None:
+                return
+            self.add_path(representative)
+            self.representatives[key] = representative
+            if self.tile is not None:
+                self.tile["representatives"][key] = representative
+        pixel = (context["lat"], context["lng"])
+        sites = self.snapped[context["workDir"]].get(pixel, [pixel])
+        self.members.write(
+            context["workDir"], ((representative, *site) for site in sites)
+        )
+
+
+def _tiles(runs, peers, config):
+    """
+    Partition the pixels into ``setupTiles`` square tiles of the grid used by
+    ``snapToGrid`` (by default the first run's ``harvestArea``).
+
+    :returns: A sorted list of (tile, selection) pairs, where selection maps a
+        run index to the rows of its pixels in the tile.
+    """
+    tile_size = config.get("setupTiles")
+    grid = None
+    if tile_size:
+        snap = config.get("snapToGrid") or True
+        grid = next(
+            filter(None, (pythia.io.snap_grid(run, snap) for run in runs)), None
+        )
+        if grid is None:
+            logging.warning("[PEERLESS] setupTiles needs a raster grid, not tiling")
+    if grid is None:
+        return [(0, None)]
+    tiles = {}
+    for idx, peer in enumerate(peers):
+        ids = pythia.io.grid_tiles(grid, peer.lng, peer.lat, tile_size)
+        order = np.argsort(ids, kind="stable")
+        unique, starts = np.unique(ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for tile, start, end in zip(unique.tolist(), starts, ends):
+            tiles.setdefault(tile, {})[idx] = order[start:end]
+    # An empty domain is set up like an untiled one.
+    return sorted(tiles.items()) or [(0, None)]
+
+
+def _tiles_dir(runs, config):
+    """The checkpoint directory of a tiled setup, keyed by its inputs."""
+    payload = {
+        "peers": [
+            pythia.cache_manager.peer_fingerprint(
+                run,
+                config.get("sample", None),
+                config.get("snapToGrid"),
+                config.get("rasterCube"),
+            )
+            for run in runs
+        ],
+        "runs": runs,
+        "tiles": config.get("setupTiles"),
+        "collapse": [config.get("collapseIdentical"), config.get("collapseIgnore")],
+    }
+    return os.path.join(
+        pythia.cache_manager.cache_dir(config),
+        "tiles",
+        pythia.cache_manager.fingerprint(payload),
+    )
+
+
+def _tile_marker(tiles_dir, tile):
+    return os.path.join(tiles_dir, "tile_{}.json".format(tile))
+
+
+def _write_tile_marker(tiles_dir, tile, results):
+    os.makedirs(tiles_dir, exist_ok=True)
+    marker = _tile_marker(tiles_dir, tile)
+    tmp_marker = "{}.{}.tmp".format(marker, os.getpid())
+    with open(tmp_marker, "w") as f:
+        json.dump(results, f)
+    os.replace(tmp_marker, marker)
 
 
 def symlink_wth_soil(output_dir, config, context):
@@ -74,10 +365,21 @@ def compose_peerless(context, config, env):
     if not config["silence"]:
         print(".", end="", flush=True)
     this_output_dir = context["contextWorkDir"]
+    incremental = config.get("incrementalSetup", False)
+    if incremental:
+        signature = pythia.cache_manager.pixel_fingerprint(context, config)
+        if pythia.cache_manager.pixel_unchanged(
+            this_output_dir, context["template"], signature
+        ):
+            return this_output_dir
     symlink_wth_soil(this_output_dir, config, context)
     xfile = pythia.template.render_template(env, context["template"], context)
     with open(os.path.join(context["contextWorkDir"], context["template"]), "w") as f:
         f.write(xfile)
+    if incremental:
+        pythia.cache_manager.save_pixel_fingerprint(
+            this_output_dir, context["template"], signature
+        )
     return context["contextWorkDir"]
 
 
@@ -117,29 +419,129 @@ def execute(config, plugins):
     runs = config.get("runs", [])
     if len(runs) == 0:
         return
-    runlist = []
+    # Fail on invalid lookups before sampling any raster.
+    plans = pythia.plan.compile_runs(runs)
+    pythia.context.register_runs(runs)
     for run in runs:
         pythia.io.make_run_directory(os.path.join(config["workDir"], run["name"]))
 
-    peers = [pythia.io.peer(r, config.get("sample", None)) for r in runs]
+    peers = pythia.cache_manager.peer_runs(runs, config)
+    if config.get("pixelOrder"):
+        peers = [p.take(pythia.gis.curve_order(p.lng, p.lat, config["pixelOrder"])) for p in peers]
+    tiles = _tiles(runs, peers, config)
+    tiled = tiles[0][1] is not None
+    tiles_dir = _tiles_dir(runs, config) if tiled else None
+    resuming = tiled and os.path.isdir(tiles_dir)
+    if config.get("contextStore", False) and not resuming:
+        pythia.context_store.reset(config, runs)
+    if config.get("sharedRasters", False):
+        pythia.shared_rasters.share(config)
+    if config.get("vectorIndexCache", True):
+        _index_vectors(config, runs)
     pool_size = config.get("threads", mp.cpu_count())
     print("RUNNING WITH POOL SIZE: {}".format(pool_size))
     env = pythia.template.init_engine(config["templateDir"])
 
     # Parallelize the context build (build_context), it is CPU intensive because it
     #  runs the functions (functions.py) declared in the config files.
-    with concurrent.futures.ProcessPoolExecutor(max_workers=pool_size) as executor:
-        tasks = _generate_context_args(runs, peers, config, plugins)
-        future_to_context = {executor.submit(build_context, *task): task for task in tasks}
-
-        # process_context is mostly I/O intensive, no reason to parallelize it.
-        for future in concurrent.futures.as_completed(future_to_context):
-            context_result = future.result()
-            if context_result is not None:
-                processed_result = process_context(context_result, plugins, config, env)
-                if processed_result is not None:
-                    runlist.append(processed_result)
+    layers = [list(peer.layers) for peer in peers]
+    collapse = config.get("collapseIdentical", False)
+    collapse_ignore = None
+    if collapse:
+        collapse_ignore = set(COLLAPSE_IGNORE) | set(config.get("collapseIgnore", []))
+    results = _SetupResults(runs, peers, config, collapse_ignore)
+    done = set()
+    checkpoint = None
+    if resuming:
+        # Tiles are set up in order, the last checkpoint holds the members
+        # recorded up to the first unfinished tile.
+        for tile, _ in tiles:
+            marker = _tile_marker(tiles_dir, tile)
+            if not os.path.exists(marker):
+                continue
+            with open(marker) as f:
+                checkpoint = json.load(f)
+            results.restore_tile(checkpoint)
+            done.add(tile)
+        logging.info("[PEERLESS] %d of %d tiles already set up", len(done), len(tiles))
+    results.open_members(checkpoint["members"] if checkpoint else None)
+    with pythia.executors.create(
+        config,
+        "setup",
+        pool_size,
+        initializer=_init_worker,
+        initargs=(config, plugins, layers, plans),
+    ) as executor:
+        window = config.get("maxTasksInFlight", pool_size * 8)
+        for tile_idx, (tile, selection) in enumerate(tiles):
+            if tile in done:
+                continue
+            if tiled:
+                logging.info(
+                    "[PEERLESS] Setting up tile %s (%d/%d)", tile, tile_idx + 1, len(tiles)
+                )
+                results.start_tile(tile)
+                if config.get("contextStore", False):
+                    pythia.context_store.discard(config, runs, tile)
+            tasks = results.tasks(peers, selection, tile if tiled else None)
+
+            if config.get("renderInWorkers", False) and not collapse:
+                # The workers also render and write the pixel directories, the
+                # parent only collects the run list.
+                for processed_result in pythia.executors.bounded_results(
+                    executor, _render_context_task, tasks, window
+                ):
+                    results.add_path(processed_result)
+            else:
+                # process_context runs in the parent, one pixel at a time.
+                for context_result in pythia.executors.bounded_results(
+                    executor, _build_context_task, tasks, window
+                ):
+                    if context_result is not None:
+                        results.add_context(context_result, plugins, config, env)
+            if tiled:
+                _write_tile_marker(tiles_dir, tile, results.finish_tile())
+    # The serial and thread executors saved contexts from this process.
+    pythia.context_store.close()
+    results.close_members()
+
+    runlist = results.runlist
+    if collapse or config.get("snapToGrid"):
+        logging.info(
+            "[PEERLESS] %d sites simulated by %d directories",
+            results.members.count,
+            len(runlist),
+        )
+    if tiled:
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+    _finish_setup(runlist, plugins, config, env)
+
+
+def render(config, plugins):
+    """
+    Write the pixel directories again from the contexts stored by the previous
+    setup, re-applying the templates and ``post_build_context`` plugins without
+    resolving any lookup.
+    """
+    runs = config.get("runs", [])
+    missing = [run["name"] for run in runs if not pythia.context_store.exists(config, run)]
+    if missing:
+        logging.error(
+            "[PEERLESS] No stored contexts for %s, run --setup with contextStore enabled",
+            ", ".join(missing),
+        )
+        return
+    runlist = []
+    env = pythia.template.init_engine(config["templateDir"])
+    for run in runs:
+        for context in pythia.context_store.load(config, run):
+            processed_result = process_context(context, plugins, config, env)
+            if processed_result is not None:
+                runlist.append(processed_result)
+    _finish_setup(runlist, plugins, config, env)
+
 
+def _finish_setup(runlist, plugins, config, env):
     if config["exportRunlist"]:
         with open(os.path.join(config["workDir"], "run_list.txt"), "w") as f:
             [f.write(f"{x}\n") for x in runlist]
@@ -0,0 +1,185 @@
+"""
+Lookup plans compiled from the run configurations.
+
+A run value such as ``"lookup_ghr::raster::soil.tif"`` asks setup to call
+`pythia.functions.lookup_ghr` for every pixel. `compile_run` parses those specs
+once, binds the functions and orders them so that every ``$name`` reference is
+resolved before it is used, failing on unknown functions, references and
+cycles before any pixel is processed.
+
+Lookups declared pure with `pythia.functions.pure` are memoized per process in
+a bounded `LookupCache`, keyed by the inputs they declare.
+"""
+import copy
+import logging
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Tuple
+
+import pythia.functions
+
+# Context keys set by a lookup besides its own key.
+PRODUCES = {
+    "auto_planting_window": ("pdate", "pfrst", "plast"),
+    "auto_planting_window_doy": ("pdate", "pfrst", "plast"),
+    "auto_planting_window_doy_shape": ("pdate", "pfrst", "plast"),
+    "lookup_ghr": ("soilFiles",),
+    "lookup_wth": ("wthFile",),
+}
+
+# Context keys of every pixel that are not run values.
+PIXEL_KEYS = ("lat", "lng", "xcrd", "ycrd", "contextWorkDir")
+
+
+class LookupStep(NamedTuple):
+    key: str
+    name: str
+    fn: Callable
+    args: Tuple[str, ...]
+    refs: Tuple[str, ...]
+
+
+def is_lookup(key, value):
+    return (
+        key != "sites"
+        and isinstance(value, str)
+        and "::" in value
+        and value.split("::")[0] != "raster"
+    )
+
+
+def _step(run_name, key, value):
+    name = value.split("::")[0]
+    fn = getattr(pythia.functions, name, None)
+    if not callable(fn):
+        raise ValueError(
+            "Run {}: {} uses the unknown function {}".format(run_name, key, name)
+        )
+    args = pythia.functions.lookup_args(value)
+    refs = tuple(arg[1:] for arg in args if arg.startswith("$"))
+    return LookupStep(key, name, fn, args, refs)
+
+
+def _dependencies(steps, idx):
+    step = steps[idx]
+    deps = set()
+    for ref in step.refs:
+        if ref == step.key:
+            continue
+        for other_idx, other in enumerate(steps):
+            if other_idx != idx and (
+                other.key == ref or ref in PRODUCES.get(other.name, ())
+            ):
+                deps.add(other_idx)
+    return deps
+
+
+def compile_run(run):
+    """
+    Compile the lookups of a merged run into the order they must run in.
+
+    Lookups keep their declared order unless a ``$name`` reference requires a
+    later one to run first.
+
+    :returns: A list of LookupSteps.
+    :raises ValueError: On unknown functions or references, or a reference cycle.
+    """
+    run_name = run.get("name", "")
+    steps = [_step(run_name, k, v) for k, v in run.items() if is_lookup(k, v)]
+
+    known = set(run) | set(PIXEL_KEYS)
+    for step in steps:
+        known.update(PRODUCES.get(step.name, ()))
+    for step in steps:
+        for ref in step.refs:
+            if ref not in known:
+                raise ValueError(
+                    "Run {}: {} references ${} which is not defined".format(
+                        run_name, step.key, ref
+                    )
+                )
+
+    pending = {idx: _dependencies(steps, idx) for idx in range(len(steps))}
+    order = []
+    while pending:
+        ready = [idx for idx in sorted(pending) if not pending[idx]]
+        if not ready:
+            raise ValueError(
+                "Run {}: circular references between {}".format(
+                    run_name, ", ".join(steps[idx].key for idx in sorted(pending))
+                )
+            )
+        idx = ready[0]
+        order.append(steps[idx])
+        del pending[idx]
+        for deps in pending.values():
+            deps.discard(idx)
+    logging.debug("[PLAN] %s: %s", run_name, [step.key for step in order])
+    return order
+
+
+class LookupCache:
+    """A bounded least-recently-used cache of pure lookup results."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+lookup_cache = LookupCache()
+
+
+def configure_cache(maxsize):
+    """Replace this process' lookup cache; a size of 0 disables memoization."""
+    global lookup_cache
+    lookup_cache = LookupCache(maxsize)
+
+
+def log_cache_stats():
+    stats = lookup_cache.stats()
+    logging.info(
+        "[PLAN] Lookup cache: %d hits, %d misses, %d entries",
+        stats["hits"],
+        stats["misses"],
+        stats["size"],
+    )
+
+
+def call_step(step, run, context, config):
+    """Run a lookup step for a pixel, reusing the result of a pure lookup."""
+    inputs = pythia.functions.PURE_FUNCTIONS.get(step.name)
+    if inputs is None or lookup_cache.maxsize <= 0:
+        return step.fn(step.key, run, context, config)
+    key = (step.name, step.key, inputs(step.key, run, context))
+    try:
+        result = lookup_cache.get(key)
+    except KeyError:
+        result = step.fn(step.key, run, context, config)
+        lookup_cache.put(key, result)
+    except TypeError:
+        # Unhashable inputs, e.g. a list in the context.
+        return step.fn(step.key, run, context, config)
+    return copy.deepcopy(result)
+
+
+def compile_runs(runs) -> List[List[LookupStep]]:
+    return [compile_run(run) for run in runs]
@@ -0,0 +1,201 @@
+"""
+Aligned multi-band raster cube for the raster layers of a configuration.
+
+Every raster referenced by a configuration is stacked into one tiled GeoTIFF
+that shares the grid of a reference raster. Layers on a different grid are
+reprojected (nearest neighbour) once while the cube is built, so setup only
+computes one row/column per site and reads one file instead of one per layer.
+"""
+import itertools
+import logging
+import os
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+
+import pythia.functions
+import pythia.io
+import pythia.util
+
+
+def config_rasters(config):
+    """
+    List the raster files referenced by a configuration in the order they first
+    appear, `harvestArea` layers of the default setup first.
+    """
+    default_setup = config.get("default_setup", {})
+    values = itertools.chain(
+        [default_setup["harvestArea"]] if "harvestArea" in default_setup else [],
+        default_setup.values(),
+        *[run.values() for run in config.get("runs", [])],
+    )
+    rasters = []
+    for value in values:
+        if pythia.util.is_raster_lookup(value):
+            raster = pythia.functions.extract_raster(value)
+            if raster not in rasters:
+                rasters.append(raster)
+    return rasters
+
+
+def _aligned(src, ref):
+    return (
+        src.crs == ref.crs
+        and src.transform == ref.transform
+        and src.width == ref.width
+        and src.height == ref.height
+    )
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return "{}:{}".format(stat.st_mtime_ns, stat.st_size)
+
+
+def build_cube(config, output, rasters=None):
+    """
+    Stack every band of every raster in the configuration into `output`.
+
+    The grid of the first raster is used for the cube. Band values are stored in
+    the smallest floating point type that holds every source type exactly, with
+    NaN as nodata; the source path, band, data type and file signature of each
+    band are recorded in its tags so readers can restore the original values.
+
+    :param config: The loaded Pythia configuration.
+    :param output: The GeoTIFF to create.
+    :param rasters: Optional explicit list of rasters; defaults to every raster
+        referenced by the configuration.
+    :returns: The number of bands written.
+    """
+    rasters = rasters or config_rasters(config)
+    if not rasters:
+        logging.warning("[CUBE] No raster layers found in the configuration.")
+        return 0
+
+    sources = []
+    for raster in rasters:
+        with rasterio.open(raster) as src:
+            sources.extend((raster, band, src.dtypes[band - 1]) for band in src.indexes)
+    dtype = np.result_type(np.float32, *[np.dtype(s[2]) for s in sources])
+
+    with rasterio.open(rasters[0]) as ref:
+        profile = {
+            "driver": "GTiff",
+            "width": ref.width,
+            "height": ref.height,
+            "count": len(sources),
+            "dtype": dtype.name,
+            "nodata": np.nan,
+            "crs": ref.crs,
+            "transform": ref.transform,
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+            "compress": "deflate",
+            "BIGTIFF": "IF_SAFER",
+        }
+        grid = {"crs": ref.crs, "transform": ref.transform, "width": ref.width, "height": ref.height}
+
+    with rasterio.open(output, "w", **profile) as dst:
+        windows = [window for _, window in dst.block_windows(1)]
+        cube_band = 1
+        for raster in rasters:
+            with rasterio.open(raster) as src:
+                indexes = list(src.indexes)
+                if _aligned(src, dst):
+                    reader = src
+                else:
+                    logging.info("[CUBE] Reprojecting %s onto the cube grid.", raster)
+                    reader = WarpedVRT(
+                        src,
+                        resampling=Resampling.nearest,
+                        add_alpha=src.nodata is None,
+                        **grid,
+                    )
+                with reader:
+                    for window in windows:
+                        data = reader.read(indexes, window=window, masked=True)
+                        dst.write(
+                            data.astype(dtype).filled(np.nan),
+                            indexes=[cube_band + i for i in range(len(indexes))],
+                            window=window,
+                        )
+                for i, band in enumerate(indexes):
+                    dst.update_tags(
+                        cube_band + i,
+                        source=os.path.abspath(raster),
+                        band=band,
+                        dtype=src.dtypes[band - 1],
+                        signature=_source_signature(raster),
+                    )
+                    dst.set_band_description(cube_band + i, "{}:{}".format(raster, band))
+                cube_band += len(indexes)
+    logging.info("[CUBE] Wrote %d bands to %s", len(sources), output)
+    return len(sources)
+
+
+class RasterCube:
+    """
+    Read access to a cube built by `build_cube`.
+
+    The row and column of each site are computed once against the cube grid and
+    reused for every layer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dataset = rasterio.open(path)
+        self._bands = {}
+        self._checked = {}
+        for idx in self.dataset.indexes:
+            tags = self.dataset.tags(idx)
+            if "source" in tags:
+                key = (tags["source"], int(tags["band"]))
+                self._bands[key] = (idx, tags["dtype"], tags.get("signature"))
+
+    def close(self):
+        self.dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def band_for(self, raster, band=1):
+        """
+        The cube band holding `raster`, or None if the raster is not in the cube
+        or changed after the cube was built.
+        """
+        key = (os.path.abspath(raster), band)
+        if key not in self._checked:
+            self._checked[key] = self._check_band(raster, key)
+        return self._checked[key]
+
+    def _check_band(self, raster, key):
+        entry = self._bands.get(key)
+        if entry is None:
+            return None
+        try:
+            current = _source_signature(raster)
+        except OSError:
+            current = None
+        if current != entry[2]:
+            logging.warning("[CUBE] %s changed since %s was built, reading it directly.", raster, self.path)
+            return None
+        return entry[0], entry[1]
+
+    def pixels(self, lng, lat):
+        return pythia.io.site_pixels(self.dataset, lng, lat)
+
+    def sample(self, cube_band, dtype, rows, cols, windowed=True):
+        """Sample a cube band at cells of the cube grid in its original data type."""
+        values, valid = pythia.io.sample_pixels(
+            self.dataset, rows, cols, cube_band, windowed
+        )
+        valid &= ~np.isnan(values)
+        restored = np.zeros(len(values), dtype=dtype)
+        restored[valid] = values[valid].astype(dtype)
+        return restored, valid
@@ -0,0 +1,238 @@
+"""
+Raster bands and lookup tables shared by the setup worker processes.
+
+The parent process exports the rasters that context functions open in the
+workers (the soil raster of ``lookup_ghr``) and the legacy ``GHR.db`` profile map to
+``.npy`` files under ``cacheDir``. Workers memory-map them read-only, so every
+process reads the same pages from the operating system's page cache instead of
+holding its own copy, and memory does not grow with the number of workers.
+"""
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import numpy.ma as ma
+import rasterio
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import Affine, array_bounds, rowcol
+
+import pythia.cache_manager
+import pythia.functions
+import pythia.util
+
+_attached = {}
+
+
+# Lookup functions that open their raster in the setup workers. The rasters
+# of every other lookup are sampled by `pythia.io.peer` and never reopened.
+WORKER_RASTER_LOOKUPS = ("lookup_ghr",)
+
+
+def worker_rasters(config):
+    """
+    The rasters opened by context functions in the setup workers, i.e. the
+    rasters of the `WORKER_RASTER_LOOKUPS` lookups.
+    """
+    rasters = []
+    for run in config.get("runs", []):
+        for k, v in run.items():
+            if k == "sites" or not pythia.util.is_raster_lookup(v):
+                continue
+            if str(v).split("::")[0] not in WORKER_RASTER_LOOKUPS:
+                continue
+            raster = os.path.abspath(pythia.functions.extract_raster(v))
+            if raster not in rasters:
+                rasters.append(raster)
+    return rasters
+
+
+def _export_dir(config, kind, path):
+    signature = pythia.cache_manager.file_signature(path)
+    key = pythia.cache_manager.fingerprint([kind, signature])
+    return os.path.join(pythia.cache_manager.cache_dir(config), "shared", key)
+
+
+def _publish(tmp_dir, target):
+    if os.path.exists(target):
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, target)
+
+
+def export_raster(config, raster):
+    """
+    Write every band of `raster` into a memory-mappable ``.npy`` stack, reading
+    it one block at a time. Existing exports of an unchanged raster are reused.
+
+    :returns: The export directory.
+    """
+    target = _export_dir(config, "raster", raster)
+    if os.path.exists(os.path.join(target, "meta.json")):
+        return target
+    tmp_dir = "{}.{}.tmp".format(target, os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    with rasterio.open(raster) as src:
+        bands = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "bands.npy"),
+            mode="w+",
+            dtype=src.dtypes[0],
+            shape=(src.count, src.height, src.width),
+        )
+        for _, window in src.block_windows(1):
+            rows, cols = window.toslices()
+            bands[:, rows, cols] = src.read(window=window)
+        bands.flush()
+        del bands
+        meta = {
+            "name": raster,
+            "crs": src.crs.to_wkt() if src.crs else None,
+            "transform": list(src.transform)[:6],
+            "nodata": src.nodata,
+        }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    _publish(tmp_dir, target)
+    return target
+
+
+def export_ghr_profiles(config):
+    """
+    Export the ``GHR.db`` profile map as sorted ID and profile arrays.
+
+    :returns: The export directory, or None when no ``GHR.db`` is configured.
+    """
+    try:
+        db_path = pythia.functions._ghr_database_path(config)
+    except (FileNotFoundError, ValueError):
+        return None
+    target = _export_dir(config, "ghr", str(db_path))
+    if os.path.exists(os.path.join(target, "profiles.npy")):
+        return target
+    tmp_dir = "{}.{}.tmp".format(target, os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    profiles = pythia.functions.build_ghr_cache(config)
+    ids = np.array(sorted(profiles), dtype=np.int64)
+    names = np.array([profiles[i].encode("utf-8") for i in ids.tolist()], dtype=bytes)
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+    np.save(os.path.join(tmp_dir, "profiles.npy"), names)
+    _publish(tmp_dir, target)
+    return target
+
+
+def share(config):
+    """
+    Export the rasters and lookup tables used by the setup workers and record
+    them in ``config["_shared"]``, which is handed to every worker.
+    """
+    shared = {"rasters": {}, "ghr": None}
+    for raster in worker_rasters(config):
+        logging.info("[SHARED] Exporting %s", raster)
+        shared["rasters"][raster] = export_raster(config, raster)
+    if any(
+        str(v).startswith("lookup_ghr::")
+        for run in config.get("runs", [])
+        for v in run.values()
+    ):
+        shared["ghr"] = export_ghr_profiles(config)
+    config["_shared"] = shared
+    return shared
+
+
+class MemmapRaster:
+    """
+    A read-only stand-in for a rasterio dataset backed by a memory-mapped export.
+
+    It implements the subset of the dataset API used by the context functions:
+    the grid attributes, `index` and windowed `read`.
+    """
+
+    def __init__(self, export_dir):
+        with open(os.path.join(export_dir, "meta.json")) as f:
+            meta = json.load(f)
+        self.bands = np.load(os.path.join(export_dir, "bands.npy"), mmap_mode="r")
+        self.name = meta["name"]
+        self.crs = CRS.from_wkt(meta["crs"]) if meta["crs"] else None
+        self.transform = Affine(*meta["transform"])
+        self.nodata = meta["nodata"]
+        self.count, self.height, self.width = self.bands.shape
+        self.indexes = tuple(range(1, self.count + 1))
+        self.bounds = BoundingBox(
+            *array_bounds(self.height, self.width, self.transform)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def index(self, x, y):
+        row, col = rowcol(self.transform, [x], [y])
+        return int(row[0]), int(col[0])
+
+    def read(self, indexes=None, window=None, masked=False):
+        band_list = self.indexes if indexes is None else indexes
+        single = isinstance(band_list, int)
+        selection = [band_list - 1] if single else [i - 1 for i in band_list]
+        if window is None:
+            data = self.bands[selection]
+        else:
+            rows, cols = window.toslices()
+            data = self.bands[selection, rows, cols]
+        data = np.array(data)
+        if single:
+            data = data[0]
+        if not masked:
+            return data
+        if self.nodata is None:
+            return ma.masked_array(data, mask=False)
+        if np.isnan(self.nodata):
+            return ma.masked_invalid(data)
+        return ma.masked_equal(data, self.nodata)
+
+
+class SharedProfiles:
+    """The exported ``GHR.db`` profile map, searched without loading it."""
+
+    def __init__(self, export_dir):
+        self.ids = np.load(os.path.join(export_dir, "ids.npy"), mmap_mode="r")
+        self.profiles = np.load(os.path.join(export_dir, "profiles.npy"), mmap_mode="r")
+
+    def lookup(self, soil_id):
+        idx = int(np.searchsorted(self.ids, soil_id))
+        if idx >= len(self.ids) or self.ids[idx] != soil_id:
+            return None
+        return self.profiles[idx].decode("utf-8")
+
+
+def _attach(factory, export_dir):
+    if export_dir not in _attached:
+        _attached[export_dir] = factory(export_dir)
+    return _attached[export_dir]
+
+
+def open_raster(path, config=None):
+    """
+    Open a raster for a context function: the shared memory-mapped export when
+    the parent process exported it, otherwise the file itself through rasterio.
+    """
+    shared = (config or {}).get("_shared")
+    if shared:
+        export_dir = shared["rasters"].get(os.path.abspath(path))
+        if export_dir is not None:
+            return _attach(MemmapRaster, export_dir)
+    return rasterio.open(path)
+
+
+def ghr_profiles(config):
+    """The shared ``GHR.db`` profile map, or None when it was not exported."""
+    shared = (config or {}).get("_shared")
+    if not shared or not shared.get("ghr"):
+        return None
+    return _attach(SharedProfiles, shared["ghr"])
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import pythia.cache_manager
+import pythia.io
+
+
+def _write_raster(path, data):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        nodata=0,
+        crs="EPSG:4326",
+        transform=from_origin(0.0, 4.0, 1.0, 1.0),
+    ) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+def _config_and_run(tmp_path):
+    data = np.arange(1, 17, dtype="int16").reshape(4, 4)
+    raster = _write_raster(tmp_path / "harvest.tif", data)
+    config = {"workDir": str(tmp_path / "work")}
+    run = {
+        "name": "test",
+        "sites": [[3.5, 0.5], [0.5, 3.5], [9.0, 9.0]],
+        "harvestArea": "raster::{}".format(raster),
+    }
+    return config, run, raster
+
+
+def test_peer_cache_round_trip(tmp_path, monkeypatch):
+    config, run, _ = _config_and_run(tmp_path)
+    first = pythia.cache_manager.peer_runs([run], config)
+    assert len(os.listdir(pythia.cache_manager.cache_dir(config))) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("rasters should not be sampled on a cache hit")
+
+    monkeypatch.setattr(pythia.io, "peer_runs", fail)
+    second = pythia.cache_manager.peer_runs([run], config)
+    assert list(second[0]) == list(first[0])
+    assert second[0].layers["harvestArea"].dtype == np.int16
+
+
+def test_peer_cache_invalidated_by_raster_and_sample_changes(tmp_path):
+    config, run, raster = _config_and_run(tmp_path)
+    original = pythia.cache_manager.peer_cache_file(config, run)
+    stat = os.stat(raster)
+    os.utime(raster, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert pythia.cache_manager.peer_cache_file(config, run) != original
+    assert pythia.cache_manager.peer_cache_file({**config, "sample": 1}, run) != original
+    cube = {**config, "rasterCube": str(raster)}
+    assert pythia.cache_manager.peer_cache_file(cube, run) != original
+
+
+def test_peer_cache_keeps_snapped_sites(tmp_path):
+    config, run, _ = _config_and_run(tmp_path)
+    config["snapToGrid"] = True
+    run["sites"] = [[3.5, 0.5], [3.9, 0.2], [0.5, 3.5]]
+    first = pythia.cache_manager.peer_runs([run], config)[0]
+    second = pythia.cache_manager.peer_runs([run], config)[0]
+    assert len(second) == 2
+    assert second.member_sites() == first.member_sites()
+    assert second.member_sites()[0] == [(3.5, 0.5), (3.9, 0.2)]
@@ -0,0 +1,42 @@
+import pickle
+
+import pytest
+
+import pythia.context
+
+
+@pytest.fixture
+def run():
+    run = {"name": "maize", "template": "MAIZE.SNX", "include": ["A.CUL"], "ramt": 0}
+    pythia.context.register_runs([run])
+    yield run
+    pythia.context.register_runs([])
+
+
+def test_pixel_context_layers_overrides_on_the_run(run):
+    context = pythia.context.PixelContext(run, {"lat": 1.5}, 0)
+    context["ramt"] = 10
+    del context["include"]
+    assert dict(context) == {"lat": 1.5, "name": "maize", "template": "MAIZE.SNX", "ramt": 10}
+    assert "include" not in context
+    with pytest.raises(KeyError):
+        context["include"]
+    assert run["ramt"] == 0
+    context["include"] = []
+    assert context["include"] == []
+
+
+def test_pixel_context_pickles_only_the_overrides(run):
+    run["padding"] = "x" * 10000
+    context = pythia.context.PixelContext(run, {"lat": 1.5}, 0)
+    payload = pickle.dumps(context)
+    assert len(payload) < 1000
+    restored = pickle.loads(payload)
+    assert restored.base is run
+    assert dict(restored) == dict(context)
+
+
+def test_unregistered_pixel_context_pickles_as_a_dict(run):
+    other = dict(run)
+    context = pythia.context.PixelContext(other, {"lat": 1.5}, 0)
+    assert pickle.loads(pickle.dumps(context)) == dict(context)
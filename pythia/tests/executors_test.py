@@ -0,0 +1,57 @@
+import concurrent.futures
+
+import pytest
+
+import pythia.executors
+
+
+def _double(value):
+    return value * 2
+
+
+def _fail(value):
+    raise RuntimeError("task {} failed".format(value))
+
+
+class _RecordingExecutor:
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_bounded_results_limits_pending_tasks():
+    executor = _RecordingExecutor()
+    in_flight = []
+    results = []
+    tasks = ((i,) for i in range(10))
+    for result in pythia.executors.bounded_results(executor, _double, tasks, 3):
+        in_flight.append(executor.submitted - len(results))
+        results.append(result)
+    assert sorted(results) == [i * 2 for i in range(10)]
+    assert max(in_flight) <= 3
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process", "chunked"])
+def test_backends_return_every_result(backend):
+    config = {"executors": {"dssat": {"backend": backend, "chunkSize": 3}}}
+    with pythia.executors.create(config, "dssat", 2) as executor:
+        tasks = ((i,) for i in range(10))
+        results = list(pythia.executors.bounded_results(executor, _double, tasks, 4))
+    assert sorted(results) == [i * 2 for i in range(10)]
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread"])
+def test_backends_raise_task_errors(backend):
+    with pythia.executors.create({"executors": {"setup": backend}}, "setup", 2) as executor:
+        with pytest.raises(RuntimeError, match="task 0 failed"):
+            list(pythia.executors.bounded_results(executor, _fail, [(0,)], 4))
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="dask"):
+        pythia.executors.stage_options({"executors": {"setup": "dask"}}, "setup")
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+import pythia.gis
+import pythia.util
+
+
+def _grid(size):
+    y, x = np.mgrid[0:size, 0:size]
+    return x.ravel().astype(float), y.ravel().astype(float)
+
+
+def test_hilbert_order_visits_adjacent_cells():
+    x, y = _grid(8)
+    order = pythia.gis.curve_order(x, y, "hilbert")
+    assert sorted(order.tolist()) == list(range(64))
+    steps = np.abs(np.diff(x[order])) + np.abs(np.diff(y[order]))
+    assert steps.tolist() == [1.0] * 63
+
+
+def test_zorder_interleaves_quadrants():
+    x, y = _grid(2)
+    assert pythia.gis.morton_index(x, y, bits=1).tolist() == [0, 1, 2, 3]
+    assert pythia.gis.curve_order(x[::-1], y[::-1], "zorder").tolist() == [3, 2, 1, 0]
+
+
+def test_unknown_curve_is_rejected():
+    with pytest.raises(ValueError):
+        pythia.gis.curve_order([0.0], [0.0], "peano")
+
+
+def test_path_curve_order_keeps_unlocated_directories_last():
+    paths = [
+        os.path.join("work", "run", "1_0000N", "1_0000E"),
+        os.path.join("work", "run", "scratch"),
+        os.path.join("work", "run", "0_0000N", "0_0000E"),
+        os.path.join("work", "run", "0_0000N", "1_0000E"),
+    ]
+    assert pythia.util.path_curve_order(paths, "hilbert") == [2, 0, 3, 1]
+
+
+def test_pixel_ids_are_sharded_with_a_fixed_fanout():
+    assert pythia.util.translate_pixel_id(7) == ("0", "0", "7")
+    assert pythia.util.translate_pixel_id(1234567) == ("1", "234", "1234567")
@@ -0,0 +1,246 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import pythia.functions
+import pythia.gis
+import pythia.io
+
+
+def _write_tiled_raster(path, data, nodata=-1):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        nodata=nodata,
+        crs="EPSG:4326",
+        transform=from_origin(0.0, 64.0, 1.0, 1.0),
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    ) as dst:
+        dst.write(data, 1)
+    return path
+
+
+@pytest.fixture
+def tiled_raster(tmp_path):
+    data = np.arange(64 * 64, dtype="int32").reshape(64, 64)
+    data[10, 10] = -1
+    return _write_tiled_raster(tmp_path / "tiled.tif", data)
+
+
+SITES = [(0.5, 63.5), (10.5, 53.5), (40.2, 20.7), (63.9, 0.1), (-1.0, 10.0), (5.5, 70.0)]
+
+
+def test_windowed_sampling_matches_band_sampling(tiled_raster):
+    with rasterio.open(tiled_raster) as ds:
+        band = ds.read(1, masked=True)
+        expected = [pythia.io.get_site_raster_value(ds, band, site) for site in SITES]
+        lng, lat = pythia.io.coords_to_arrays(SITES)
+        values, valid = pythia.io.sample_sites(ds, lng, lat)
+        assert [v if ok else None for v, ok in zip(values, valid)] == expected
+    assert expected[0] == 0
+    assert expected[1] is None
+    assert expected[4:] == [None, None]
+
+
+def test_peer_sampling_modes_agree(tiled_raster):
+    run = {
+        "sites": [[lat, lng] for lng, lat in SITES],
+        "value": "raster::{}".format(tiled_raster),
+    }
+    windowed = pythia.io.peer(run, sampling="windowed")
+    assert list(windowed) == list(pythia.io.peer(run, sampling="band"))
+    assert len(windowed) == 3
+
+
+def test_peer_drops_zero_harvest_area_and_samples(tiled_raster):
+    run = {
+        "sites": [[lat, lng] for lng, lat in SITES],
+        "harvestArea": "raster::{}".format(tiled_raster),
+    }
+    pixels = pythia.io.peer(run)
+    assert [cell["harvestArea"] for cell in pixels] == [2792, 4095]
+    assert pixels[0] == {"lat": 20.7, "lng": 40.2, "xcrd": 40.2, "ycrd": 20.7, "harvestArea": 2792}
+    assert len(pythia.io.peer(run, sample_size=1)) == 1
+
+
+def test_peer_samples_harvest_area_first_and_keeps_layer_order(tiled_raster, tmp_path):
+    mask = np.zeros((64, 64), dtype="int32")
+    mask[20:50, 30:50] = 5
+    harvest = _write_tiled_raster(tmp_path / "harvest.tif", mask)
+    rasters = {"value": str(tiled_raster), "harvestArea": str(harvest)}
+    sampler = pythia.io.SiteSampler.from_sites([[lat, lng] for lng, lat in SITES])
+    assert pythia.io._sampling_order(rasters, sampler) == ["harvestArea", "value"]
+
+    run = {
+        "sites": [[lat, lng] for lng, lat in SITES],
+        "value": "raster::{}".format(tiled_raster),
+        "harvestArea": "raster::{}".format(harvest),
+    }
+    pixels = list(pythia.io.peer(run))
+    assert pixels == [{"lat": 20.7, "lng": 40.2, "xcrd": 40.2, "ycrd": 20.7, "value": 2792, "harvestArea": 5}]
+    assert list(pixels[0]) == ["lat", "lng", "xcrd", "ycrd", "value", "harvestArea"]
+
+
+def test_peer_runs_reads_shared_rasters_once(tiled_raster, monkeypatch):
+    calls = []
+    sample_sites = pythia.io.sample_sites
+
+    def counting_sample_sites(ds, lng, lat, **kwargs):
+        calls.append(len(lng))
+        return sample_sites(ds, lng, lat, **kwargs)
+
+    monkeypatch.setattr(pythia.io, "sample_sites", counting_sample_sites)
+    sites = [[lat, lng] for lng, lat in SITES]
+    runs = [
+        {"name": "a", "sites": sites, "value": "raster::{}".format(tiled_raster)},
+        {"name": "b", "sites": list(sites), "value": "raster::{}".format(tiled_raster)},
+    ]
+    peers = pythia.io.peer_runs(runs)
+    assert calls == [len(SITES)]
+    assert list(peers[0]) == list(peers[1])
+
+
+def test_peer_snaps_sites_to_grid_cells(tiled_raster):
+    sites = [(40.2, 20.7), (0.5, 63.5), (40.9, 20.1), (0.1, 63.9), (99.0, 99.0)]
+    run = {
+        "sites": [[lat, lng] for lng, lat in sites],
+        "value": "raster::{}".format(tiled_raster),
+    }
+    table = pythia.io.peer_runs([run], snap=True)[0]
+    assert [(cell["lng"], cell["lat"]) for cell in table] == [(40.5, 20.5), (0.5, 63.5)]
+    assert table.member_sites() == {
+        0: [(20.7, 40.2), (20.1, 40.9)],
+        1: [(63.5, 0.5), (63.9, 0.1)],
+    }
+    assert table.take([1]).member_sites() == {0: [(63.5, 0.5), (63.9, 0.1)]}
+
+
+def test_xy_from_raster_selects_cell_centers(tmp_path):
+    mask = np.zeros((64, 64), dtype="int32")
+    mask[0, 1] = 1
+    mask[40, 20] = 3
+    mask[63, 63] = 7
+    mask[10, 10] = -1
+    path = _write_tiled_raster(tmp_path / "mask.tif", mask)
+    coords = pythia.functions.xy_from_raster("xy_from_raster::{}".format(path))
+    assert coords.tolist() == [[1.5, 63.5], [20.5, 23.5], [63.5, 0.5]]
+    coords = pythia.functions.xy_from_raster("xy_from_raster::{}::2".format(path))
+    assert coords.tolist() == [[20.5, 23.5], [63.5, 0.5]]
+
+    run = {"sites": "xy_from_raster::{}".format(path), "harvestArea": "raster::{}".format(path)}
+    assert [cell["harvestArea"] for cell in pythia.io.peer(run)] == [1, 3, 7]
+
+
+def test_xy_from_table_and_table_id_lookups(tmp_path):
+    table = tmp_path / "sites.csv"
+    table.write_text("CellID,LAT,LON,doy\n101,63.5,0.5,120\n102,20.7,40.2,130\n103,0.1,63.9,140\n")
+    coords = pythia.functions.xy_from_table("xy_from_table::{}".format(table))
+    assert coords.tolist() == [[0.5, 63.5], [40.2, 20.7], [63.9, 0.1]]
+
+    run = {
+        "startYear": 2020,
+        "wsta": "lookup_wth::SSUD::table::{}::CellID".format(table),
+        "pdate": "auto_planting_window_doy_shape::table::{}::doy::0::10".format(table),
+    }
+    exact = {"lng": 40.2, "lat": 20.7}
+    assert pythia.functions.lookup_wth("wsta", run, exact, None) == {"wsta": "SSUD", "wthFile": "102.WTH"}
+    near = {"lng": 60.0, "lat": 3.0}
+    assert pythia.functions.lookup_wth("wsta", run, near, None)["wthFile"] == "103.WTH"
+    assert pythia.functions.auto_planting_window_doy_shape("pdate", run, exact, None)["pdate"] == "2020-05-10"
+
+
+def test_table_with_a_trailing_blank_line(tmp_path):
+    table = tmp_path / "sites.csv"
+    table.write_text("id,lng,lat\n1,1.0,1.0\n2,3.0,1.0\n3,2.0,2.0\n\n")
+    assert pythia.io.extract_table_coords(str(table)).tolist() == [
+        [1.0, 1.0],
+        [3.0, 1.0],
+        [2.0, 2.0],
+    ]
+    # Equally close rows resolve to the first one, as for vector lookups.
+    assert pythia.io.find_closest_table_coords(str(table), 2.0, 1.0, "id") == "1"
+    assert pythia.io.find_closest_table_coords(str(table), 2.1, 1.8, "id") == "3"
+
+
+def test_xy_from_table_reads_npz(tmp_path):
+    table = tmp_path / "sites.npz"
+    np.savez(table, x=np.array([1.5, 2.5]), y=np.array([3.5, 4.5]), id=np.array([7, 8]))
+    assert pythia.io.extract_table_coords(str(table)).tolist() == [[1.5, 3.5], [2.5, 4.5]]
+    assert pythia.io.find_closest_table_coords(str(table), 2.4, 4.4, "id") == 8
+
+
+def _write_points(path, points):
+    path.write_text(
+        json.dumps(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "geometry": {"type": kind, "coordinates": coords},
+                        "properties": {"CELL": cell},
+                    }
+                    for kind, coords, cell in points
+                ],
+            }
+        )
+    )
+    return str(path)
+
+
+def _clear_vector_caches():
+    for fn in (pythia.io.vector_points, pythia.io.index_points_ids, pythia.io.point_index):
+        fn.cache_clear()
+
+
+def test_closest_vector_point_matches_a_full_scan(tmp_path):
+    points = [
+        ("Point", (1.0, 1.0), 1),
+        ("MultiPoint", [(3.0, 1.0), (2.0, 2.0)], 2),
+        ("Point", (2.0, 2.0), 3),
+        ("Point", (1.0, 3.0), 4),
+    ]
+    vector = _write_points(tmp_path / "weather.geojson", points)
+    flat = [(1.0, 1.0, 1), (3.0, 1.0, 2), (2.0, 2.0, 2), (2.0, 2.0, 3), (1.0, 3.0, 4)]
+    rng = np.random.default_rng(0)
+    queries = [(2.0, 1.0), (1.5, 2.5), (2.0, 2.5), (2.0, 2.0), (0.0, 0.0)] + [
+        tuple(q) for q in rng.uniform(0, 4, (50, 2)).tolist()
+    ]
+    for lng, lat in queries:
+        distances = [pythia.gis.euclidean_distance(y, x, lat, lng) for x, y, _ in flat]
+        expected = flat[distances.index(min(distances))][2]
+        assert pythia.io.find_closest_vector_coords(vector, lng, lat, "CELL") == expected
+
+
+def test_vector_points_are_memory_mapped_from_the_cache(tmp_path, monkeypatch):
+    vector = _write_points(
+        tmp_path / "weather.geojson",
+        [("Point", (1.0, 1.0), 11), ("MultiPoint", [(3.0, 1.0), (2.0, 2.0)], 12)],
+    )
+    monkeypatch.setitem(pythia.io._vector_cache, "dir", str(tmp_path / "cache"))
+    _clear_vector_caches()
+    try:
+        pythia.io.vector_points(vector, "CELL")
+        _clear_vector_caches()
+
+        def fail(*args):
+            raise AssertionError("the vector file was read again")
+
+        monkeypatch.setattr(pythia.io, "read_vector_points", fail)
+        coords, ids = pythia.io.vector_points(vector, "CELL")
+        assert isinstance(coords, np.memmap)
+        assert ids.tolist() == [11, 12, 12]
+        assert pythia.io.find_closest_vector_coords(vector, 2.0, 2.0, "CELL") == 12
+        assert pythia.io.find_closest_vector_coords(vector, 1.2, 1.4, "CELL") == 11
+    finally:
+        _clear_vector_caches()
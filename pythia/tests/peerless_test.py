@@ -0,0 +1,291 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import pythia.analytics
+import pythia.config
+import pythia.context_store
+import pythia.io
+import pythia.peerless
+
+
+def _write_raster(path, data):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        nodata=0,
+        crs="EPSG:4326",
+        transform=from_origin(0.0, 4.0, 1.0, 1.0),
+    ) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+@pytest.fixture
+def setup_config(tmp_path):
+    harvest = np.array(
+        [[1, 2, 0, 4], [5, 6, 7, 8], [0, 10, 11, 12], [13, 14, 15, 16]], dtype="int32"
+    )
+    raster = _write_raster(tmp_path / "harvest.tif", harvest)
+    template_dir = tmp_path / "templates"
+    template_dir.mkdir()
+    (template_dir / "TEST.X").write_text(
+        "{{ lat }} {{ lng }} {{ harvestArea }} {{ fert_total }}\n"
+    )
+    config = {
+        "workDir": str(tmp_path / "work"),
+        "templateDir": str(template_dir),
+        "threads": 2,
+        "silence": True,
+        "exportRunlist": True,
+        "default_setup": {
+            "template": "TEST.X",
+            "soilFiles": [],
+            "sites": [[3.5, 0.5], [3.5, 2.5], [1.5, 1.5], [0.5, 3.5], [9.0, 9.0]],
+            "harvestArea": "raster::{}".format(raster),
+        },
+        "runs": [
+            {"name": "low", "fert_total": 10},
+            {"name": "high", "fert_total": 90},
+        ],
+    }
+    config["runs"] = pythia.config._merge_runs(config)
+    return config
+
+
+def _read_run_list(config):
+    with open(os.path.join(config["workDir"], "run_list.txt")) as f:
+        return sorted(line.strip() for line in f)
+
+
+def _xfiles(config):
+    return {
+        path: open(os.path.join(path, "TEST.X")).read() for path in _read_run_list(config)
+    }
+
+
+@pytest.mark.parametrize("render_in_workers", [False, True])
+def test_setup_writes_one_directory_per_valid_pixel(setup_config, render_in_workers):
+    setup_config["renderInWorkers"] = render_in_workers
+    pythia.peerless.execute(setup_config, {})
+    run_list = _read_run_list(setup_config)
+    assert len(run_list) == 6
+    xfiles = _xfiles(setup_config)
+    low = os.path.join(setup_config["workDir"], "low", "1_5000N", "1_5000E")
+    assert xfiles[os.path.abspath(low)] == "1.5 1.5 10 10"
+    high = os.path.join(setup_config["workDir"], "high", "0_5000N", "3_5000E")
+    assert xfiles[os.path.abspath(high)] == "0.5 3.5 16 90"
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "chunked"])
+def test_setup_with_a_small_task_window_writes_every_pixel(setup_config, backend):
+    setup_config["maxTasksInFlight"] = 1
+    setup_config["executors"] = {"setup": {"backend": backend, "chunkSize": 2}}
+    pythia.peerless.execute(setup_config, {})
+    assert len(_read_run_list(setup_config)) == 6
+
+
+def test_incremental_setup_rewrites_only_changed_pixels(setup_config):
+    setup_config["incrementalSetup"] = True
+    pythia.peerless.execute(setup_config, {})
+    low = os.path.join(setup_config["workDir"], "low", "1_5000N", "1_5000E", "TEST.X")
+    high = os.path.join(setup_config["workDir"], "high", "1_5000N", "1_5000E", "TEST.X")
+    low_mtime = os.stat(low).st_mtime_ns
+
+    pythia.peerless.execute(setup_config, {})
+    assert os.stat(low).st_mtime_ns == low_mtime
+
+    setup_config["runs"][1]["fert_total"] = 50
+    pythia.peerless.execute(setup_config, {})
+    assert os.stat(low).st_mtime_ns == low_mtime
+    assert open(high).read() == "1.5 1.5 10 50"
+    assert len(_read_run_list(setup_config)) == 6
+
+    os.utime(low, ns=(0, 0))
+    pythia.peerless.execute(setup_config, {})
+    assert os.stat(low).st_mtime_ns != 0
+
+
+def test_render_only_uses_the_stored_contexts(setup_config):
+    setup_config["contextStore"] = True
+    pythia.peerless.execute(setup_config, {})
+    expected = _xfiles(setup_config)
+
+    template = os.path.join(setup_config["templateDir"], "TEST.X")
+    with open(template, "w") as f:
+        f.write("{{ fert_total }} {{ harvestArea }}\n")
+    os.remove(os.path.join(setup_config["workDir"], "run_list.txt"))
+    pythia.peerless.render(setup_config, {})
+
+    rendered = _xfiles(setup_config)
+    assert sorted(rendered) == sorted(expected)
+    for path, xfile in expected.items():
+        _, _, harvest, fert = xfile.split()
+        assert rendered[path] == "{} {}".format(fert, harvest)
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread"])
+def test_repeated_setup_in_one_process_keeps_the_stored_contexts(setup_config, backend):
+    setup_config["contextStore"] = True
+    setup_config["executors"] = {"setup": backend}
+    pythia.peerless.execute(setup_config, {})
+    pythia.peerless.execute(setup_config, {})
+    for run in setup_config["runs"]:
+        assert len(list(pythia.context_store.load(setup_config, run))) == 3
+
+
+def test_collapsed_pixels_are_fanned_out_by_analytics(setup_config):
+    setup_config["collapseIdentical"] = True
+    setup_config["collapseIgnore"] = ["harvestArea"]
+    setup_config["renderInWorkers"] = True
+    pythia.peerless.execute(setup_config, {})
+    run_list = _read_run_list(setup_config)
+    assert len(run_list) == 2
+
+    low = [path for path in run_list if os.sep + "low" + os.sep in path][0]
+    with open(os.path.join(low, "summary.csv"), "w") as f:
+        f.write("RUNNO,HWAH\n1,1000\n")
+    run = setup_config["runs"][0]
+    out_file = pythia.analytics.collate_outputs(setup_config, run)
+    with open(out_file) as f:
+        rows = [line.strip().split(",") for line in f][1:]
+    assert sorted((row[0], row[1]) for row in rows) == [
+        ("0.5000", "3.5000"),
+        ("1.5000", "1.5000"),
+        ("3.5000", "0.5000"),
+    ]
+    assert {row[-1] for row in rows} == {"1000"}
+    assert sorted(row[3] for row in rows) == ["1.00", "10.00", "16.00"]
+
+
+def test_render_only_writes_the_collapsed_directories(setup_config):
+    setup_config["collapseIdentical"] = True
+    setup_config["collapseIgnore"] = ["harvestArea"]
+    setup_config["contextStore"] = True
+    pythia.peerless.execute(setup_config, {})
+    expected = _read_run_list(setup_config)
+    assert len(expected) == 2
+    pythia.peerless.render(setup_config, {})
+    assert _read_run_list(setup_config) == expected
+
+
+def test_snapped_sites_share_one_directory_per_cell(setup_config):
+    setup_config["snapToGrid"] = True
+    setup_config["renderInWorkers"] = True
+    for run in setup_config["runs"]:
+        run["sites"] = run["sites"] + [[3.9, 0.2], [1.1, 1.9]]
+    pythia.peerless.execute(setup_config, {})
+    run_list = _read_run_list(setup_config)
+    assert len(run_list) == 6
+
+    cell = os.path.join(setup_config["workDir"], "low", "3_5000N", "0_5000E")
+    with open(os.path.join(cell, "summary.csv"), "w") as f:
+        f.write("RUNNO,HWAH\n1,1000\n")
+    out_file = pythia.analytics.collate_outputs(setup_config, setup_config["runs"][0])
+    with open(out_file) as f:
+        rows = [line.strip().split(",") for line in f][1:]
+    assert sorted((row[0], row[1]) for row in rows) == [
+        ("3.5000", "0.5000"),
+        ("3.9000", "0.2000"),
+    ]
+
+
+def test_tiled_setup_resumes_at_the_first_unfinished_tile(setup_config, monkeypatch):
+    setup_config["setupTiles"] = 2
+    setup_config["executors"] = {"setup": "serial"}
+    setup_config["contextStore"] = True
+    process_context = pythia.peerless.process_context
+    processed = []
+    crash_after = [3]
+
+    def counting_process_context(context, *args):
+        if len(processed) == crash_after[0]:
+            raise KeyboardInterrupt
+        processed.append(context["workDir"])
+        return process_context(context, *args)
+
+    monkeypatch.setattr(pythia.peerless, "process_context", counting_process_context)
+    with pytest.raises(KeyboardInterrupt):
+        pythia.peerless.execute(setup_config, {})
+    tiles_dir = pythia.peerless._tiles_dir(setup_config["runs"], setup_config)
+    assert os.listdir(tiles_dir)
+
+    processed.clear()
+    crash_after[0] = None
+    pythia.peerless.execute(setup_config, {})
+    assert 3 <= len(processed) < 6
+    assert len(_read_run_list(setup_config)) == 6
+    assert not os.path.exists(tiles_dir)
+    for run in setup_config["runs"]:
+        assert len(list(pythia.context_store.load(setup_config, run))) == 3
+    pythia.peerless.render(setup_config, {})
+    with open(os.path.join(setup_config["workDir"], "run_list.txt")) as f:
+        assert len(f.read().split()) == 6
+
+
+def test_sharded_layout_maps_pixel_ids_back_to_coordinates(setup_config):
+    setup_config["workDirLayout"] = "sharded"
+    setup_config["pixelOrder"] = "hilbert"
+    pythia.peerless.execute(setup_config, {})
+    run_list = _read_run_list(setup_config)
+    assert len(run_list) == 6
+    low_dir = os.path.join(setup_config["workDir"], "low")
+    for path in run_list:
+        assert os.path.relpath(path, setup_config["workDir"]).split(os.sep)[1:3] == [
+            "0",
+            "0",
+        ]
+
+    locations = pythia.io.read_pixel_locations([low_dir])
+    pixel = [path for path, ll in locations.items() if ll == (1.5, 1.5)][0]
+    with open(os.path.join(pixel, "summary.csv"), "w") as f:
+        f.write("RUNNO,HWAH\n1,1000\n")
+    out_file = pythia.analytics.collate_outputs(setup_config, setup_config["runs"][0])
+    with open(out_file) as f:
+        rows = [line.strip().split(",") for line in f][1:]
+    assert [(row[0], row[1]) for row in rows] == [("1.5000", "1.5000")]
+
+
+def test_tiled_setup_of_an_empty_domain(setup_config):
+    setup_config["setupTiles"] = 2
+    for run in setup_config["runs"]:
+        run["sites"] = [[9.0, 9.0]]
+    pythia.peerless.execute(setup_config, {})
+    assert _read_run_list(setup_config) == []
+
+
+def test_resumed_sharded_setup_records_every_pixel_once(setup_config, monkeypatch):
+    setup_config["setupTiles"] = 2
+    setup_config["workDirLayout"] = "sharded"
+    setup_config["executors"] = {"setup": "serial"}
+    process_context = pythia.peerless.process_context
+    calls = []
+
+    def crash_on_third_pixel(context, *args):
+        calls.append(context)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return process_context(context, *args)
+
+    monkeypatch.setattr(pythia.peerless, "process_context", crash_on_third_pixel)
+    with pytest.raises(KeyboardInterrupt):
+        pythia.peerless.execute(setup_config, {})
+    monkeypatch.setattr(pythia.peerless, "process_context", process_context)
+    pythia.peerless.execute(setup_config, {})
+
+    run_list = _read_run_list(setup_config)
+    assert len(run_list) == 6
+    for run in setup_config["runs"]:
+        with open(pythia.io.pixel_members_file(run["workDir"])) as f:
+            rows = [line.split(",")[0] for line in f][1:]
+        assert len(rows) == len(set(rows))
+        members = pythia.io.read_pixel_members(run["workDir"])
+        assert all(path in members for path in run_list if os.sep + run["name"] + os.sep in path)
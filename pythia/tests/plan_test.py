@@ -0,0 +1,73 @@
+import pytest
+
+import pythia.functions
+import pythia.plan
+
+
+def _keys(plan):
+    return [step.key for step in plan]
+
+
+def test_plan_orders_lookups_after_their_references():
+    run = {
+        "name": "maize",
+        "startYear": 2020,
+        "harvestArea": "raster::harvest.tif",
+        "hdate": "date_offset::$pdate::120",
+        "wsta": "lookup_wth::SSUD::vector::sites.shp::CellID",
+        "pw": "auto_planting_window::raster::pw.tif::0::10::30",
+        "sites": "xy_from_vector::sites.shp",
+    }
+    plan = pythia.plan.compile_run(run)
+    assert _keys(plan) == ["wsta", "pw", "hdate"]
+    assert plan[2].fn is pythia.functions.date_offset
+    assert plan[2].args == ("$pdate", "120")
+    assert plan[2].refs == ("pdate",)
+
+
+def test_plan_rejects_unknown_functions():
+    with pytest.raises(ValueError, match="lookup_nothing"):
+        pythia.plan.compile_run({"name": "bad", "x": "lookup_nothing::1"})
+
+
+def test_plan_rejects_unknown_references():
+    with pytest.raises(ValueError, match=r"\$fe"):
+        pythia.plan.compile_run(
+            {"name": "bad", "fen_tot": 100, "fertilizers": "split_fert_dap_percent::$fe"}
+        )
+
+
+def test_plan_rejects_circular_references():
+    run = {
+        "name": "bad",
+        "a": "date_offset::$b::1",
+        "b": "date_offset::$a::1",
+    }
+    with pytest.raises(ValueError, match="circular"):
+        pythia.plan.compile_run(run)
+
+
+def test_pure_lookups_are_memoized_per_input(monkeypatch):
+    monkeypatch.setattr(pythia.plan, "lookup_cache", pythia.plan.LookupCache(2))
+    run = {
+        "name": "maize",
+        "fen_tot": 90.0,
+        "fert": "split_fert_dap_percent::$fen_tot::2::0::50::30::50",
+    }
+    step = pythia.plan.compile_run(run)[0]
+
+    first = pythia.plan.call_step(step, run, {"fen_tot": 90.0}, {})
+    first["fert"].append("changed")
+    second = pythia.plan.call_step(step, run, {"fen_tot": 90.0}, {})
+    assert second == {"fert": [{"fdap": 0, "famn": 45.0}, {"fdap": 30, "famn": 45.0}]}
+    pythia.plan.call_step(step, run, {"fen_tot": 60.0}, {})
+    assert pythia.plan.lookup_cache.stats() == {"hits": 1, "misses": 2, "size": 2}
+
+
+def test_lookup_cache_evicts_the_least_recently_used_entry():
+    cache = pythia.plan.LookupCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert list(cache.entries) == ["a", "c"]
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import pythia.io
+import pythia.raster_cube
+
+
+def _write_raster(path, data, res=1.0, nodata=0):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        nodata=nodata,
+        crs="EPSG:4326",
+        transform=from_origin(0.0, 8.0, res, res),
+    ) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+@pytest.fixture
+def layers(tmp_path):
+    harvest = np.arange(64, dtype="float32").reshape(8, 8)
+    soil = np.array([[5130973, 0], [17, 4000000000]], dtype="uint32")
+    return {
+        "harvestArea": _write_raster(tmp_path / "harvest.tif", harvest),
+        "soil": _write_raster(tmp_path / "soil.tif", soil, res=4.0),
+    }
+
+
+SITES = [[7.5, 1.5], [7.5, 5.5], [2.5, 2.5], [0.5, 7.5], [1.0, 12.0]]
+
+
+def _config(layers):
+    return {
+        "default_setup": {
+            "sites": SITES,
+            "harvestArea": "raster::{}".format(layers["harvestArea"]),
+            "id_soil": "lookup_ghr::raster::{}".format(layers["soil"]),
+        },
+        "runs": [],
+    }
+
+
+def test_config_rasters_lists_harvest_area_first(layers):
+    config = _config(layers)
+    assert pythia.raster_cube.config_rasters(config) == [layers["harvestArea"], layers["soil"]]
+
+
+def test_cube_sampling_matches_direct_sampling(layers, tmp_path):
+    config = _config(layers)
+    cube_path = str(tmp_path / "cube.tif")
+    assert pythia.raster_cube.build_cube(config, cube_path) == 2
+    with rasterio.open(cube_path) as cube:
+        assert (cube.width, cube.height, cube.count) == (8, 8, 2)
+
+    run = config["default_setup"]
+    direct = pythia.io.peer_runs([run])[0]
+    with pythia.raster_cube.RasterCube(cube_path) as cube:
+        cubed = pythia.io.peer_runs([run], cube=cube)[0]
+    assert list(cubed) == list(direct)
+    assert cubed.layers["id_soil"].dtype == np.uint32
+    assert [int(v) for v in cubed.layers["id_soil"]] == [5130973, 17, 4000000000]
+
+
+def test_cube_ignores_rasters_changed_after_build(layers, tmp_path):
+    cube_path = str(tmp_path / "cube.tif")
+    pythia.raster_cube.build_cube(_config(layers), cube_path)
+    stat = os.stat(layers["soil"])
+    os.utime(layers["soil"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    with pythia.raster_cube.RasterCube(cube_path) as cube:
+        assert cube.band_for(layers["harvestArea"]) == (1, "float32")
+        assert cube.band_for(layers["soil"]) is None
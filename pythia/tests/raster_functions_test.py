@@ -9,6 +9,7 @@ from rasterio.transform import from_origin
 
 import pythia.functions as fn
 import pythia.io
+import pythia.shared_rasters
 
 
 SRI_LANKA_LAT = 8.541666666666686
@@ -290,3 +291,56 @@ def test_peer_raster_read_rejects_negative_and_overflowing_indexes(soil_data):
         band = dataset.read(1, masked=True)
         assert pythia.io.get_site_raster_value(dataset, band, (79.0, 11.0)) is None
         assert pythia.io.get_site_raster_value(dataset, band, (84.0, 8.0)) is None
+
+
+@pytest.mark.parametrize("raster", ["legacy_raster", "encoded_raster"])
+def test_lookup_ghr_reads_shared_exports(soil_data, tmp_path, raster, monkeypatch):
+    raster_path = str(soil_data[raster])
+    config = {
+        "ghr_root": str(soil_data["root"]),
+        "workDir": str(tmp_path / "work"),
+        "runs": [{"id_soil": f"lookup_ghr::raster::{raster_path}"}],
+    }
+    shared = pythia.shared_rasters.share(config)
+    assert list(shared["rasters"]) == [raster_path]
+    assert shared["ghr"] is not None
+
+    def no_rasterio(*args, **kwargs):
+        raise AssertionError("shared rasters should not be opened with rasterio")
+
+    monkeypatch.setattr(pythia.shared_rasters.rasterio, "open", no_rasterio)
+    monkeypatch.setattr(fn, "_lookup_ghr_profile_cached", no_rasterio)
+    result = fn.lookup_ghr(
+        "id_soil",
+        config["runs"][0],
+        {"lat": SRI_LANKA_LAT, "lng": SRI_LANKA_LON, "id_soil": LEGACY_SOIL_ID},
+        config,
+    )
+    assert result == {"id_soil": PROFILE_ID, "soilFiles": [str(soil_data["soil_file"])]}
+
+
+def test_only_rasters_opened_by_workers_are_shared(soil_data):
+    raster_path = str(soil_data["encoded_raster"])
+    config = {
+        "runs": [
+            {
+                "id_soil": f"lookup_ghr::raster::{raster_path}",
+                "pdate": "auto_planting_window::raster::pw.tif",
+                "cul": "lookup_hc27::raster::hc.tif",
+            }
+        ]
+    }
+    assert pythia.shared_rasters.worker_rasters(config) == [raster_path]
+
+
+def test_memmap_raster_matches_rasterio_reads(soil_data, tmp_path):
+    config = {"workDir": str(tmp_path / "work")}
+    export = pythia.shared_rasters.export_raster(config, str(soil_data["encoded_raster"]))
+    shared = pythia.shared_rasters.MemmapRaster(export)
+    with rasterio.open(soil_data["encoded_raster"]) as src:
+        assert shared.bounds == src.bounds
+        assert shared.index(81.5, 8.5) == src.index(81.5, 8.5)
+        window = rasterio.windows.Window(1, 1, 2, 1)
+        expected = src.read(indexes=(1, 2), window=window, masked=True)
+        actual = shared.read(indexes=(1, 2), window=window, masked=True)
+        assert actual.tolist() == expected.tolist()
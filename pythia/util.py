@@ -1,7 +1,11 @@
 import datetime
 import logging
+import os
+
+import numpy as np
 
 import pythia.functions
+import pythia.gis
 
 
 def to_julian_date(d):
@@ -48,12 +52,17 @@ def from_iso_date(s):
         return None
 
 
+def is_raster_lookup(value):
+    """True if a configuration value references a raster, e.g. `lookup_ghr::raster::<file>`."""
+    return "raster" in str(value).split("::")[:-1]
+
+
 def get_rasters_list(iterator):
     return list(
         set(
             [
                 pythia.functions.extract_raster(raster)
-                for raster in list(filter(lambda x: "raster::" in str(x), iterator))
+                for raster in list(filter(is_raster_lookup, iterator))
             ]
         )
     )
@@ -63,7 +72,7 @@ def get_rasters_dict(iterator):
     return {
         k: pythia.functions.extract_raster(v)
         for (k, v) in iterator.items()
-        if "raster::" in str(v)
+        if is_raster_lookup(v)
     }
 
 
@@ -79,8 +88,65 @@ def translate_coords_news(lat, lng):
     return y, x
 
 
+# Pixel directories per shard directory in the ``sharded`` work directory layout.
+PIXEL_SHARD_FANOUT = 1000
+
+
+def translate_pixel_id(pixel_id):
+    """
+    The directories of a pixel in the ``sharded`` work directory layout. Pixel
+    ``1234567`` is stored in ``1/234/1234567``, so no directory holds more than
+    `PIXEL_SHARD_FANOUT` entries below the top level.
+    """
+    return (
+        str(pixel_id // PIXEL_SHARD_FANOUT ** 2),
+        str(pixel_id // PIXEL_SHARD_FANOUT % PIXEL_SHARD_FANOUT),
+        str(pixel_id),
+    )
+
+
+def pixel_dir_parts(config, lat, lng, pixel_id=None):
+    """The directories of a pixel below its run, following ``workDirLayout``."""
+    if config.get("workDirLayout", "coords") == "sharded" and pixel_id is not None:
+        return translate_pixel_id(pixel_id)
+    return translate_coords_news(lat, lng)
+
+
 def translate_news_coords(news):
     if news.endswith("N") or news.endswith("E"):
         return news.replace("_", ".")[:-1]
     else:
         return "-{}".format(news.replace("_", ".")[:-1])
+
+
+def coords_from_dir(path):
+    """The (lat, lng) pair encoded in a pixel directory by `translate_coords_news`, or None."""
+    parts = os.path.normpath(path).split(os.path.sep)[-2:]
+    if len(parts) != 2:
+        return None
+    try:
+        return tuple(float(translate_news_coords(p)) for p in parts)
+    except ValueError:
+        return None
+
+
+def path_curve_order(paths, curve, locations=None):
+    """
+    Order pixel directories along a space-filling curve of their coordinates.
+
+    :param paths: Pixel directories laid out by `translate_coords_news`.
+    :param curve: ``hilbert`` or ``zorder``.
+    :param locations: Optional (lat, lng) by absolute directory, for directories
+        whose path does not encode their coordinates.
+    :returns: A list of indexes into `paths`; directories without coordinates keep
+        their relative order at the end.
+    """
+    locations = locations or {}
+    coords = [
+        locations.get(os.path.abspath(path)) or coords_from_dir(path) for path in paths
+    ]
+    located = [idx for idx, c in enumerate(coords) if c is not None]
+    lat = np.array([coords[idx][0] for idx in located], dtype=float)
+    lng = np.array([coords[idx][1] for idx in located], dtype=float)
+    order = [located[idx] for idx in pythia.gis.curve_order(lng, lat, curve)]
+    return order + [idx for idx, c in enumerate(coords) if c is None]